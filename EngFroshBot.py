@@ -3,24 +3,34 @@
 from __future__ import annotations
 import asyncio
 
+import contextvars
+import functools
 import io
-from typing import Any, Dict, Optional, Set
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
 import nextcord
 from nextcord import Interaction
 from nextcord.ext import commands, application_checks
 from nextcord.utils import get
 from nextcord.errors import ApplicationCheckFailure
 import logging
+import json
 import datetime as dt
 import traceback
 from common_models.models import DiscordUser
-from asgiref.sync import sync_to_async
 from random import randrange
-from django.db import close_old_connections
+from django.db import close_old_connections, connection
 from sentry_sdk import capture_exception
+from bulk import BulkJob, interaction_progress
+from metrics import Metrics, count_queries, instrument_http, interaction_queries
+from guild_index import GuildIndex
 import sys
 
 logger = logging.getLogger("EngFroshBot")
+audit_logger = logging.getLogger("EngFroshBot.audit")
 
 LOG_LEVELS = {
     "CRITICAL": 50,
@@ -36,6 +46,428 @@ instance = None
 global_config = {}
 
 
+class InteractionAudit:
+    """Audit record of an interaction, only rendered to text when a handler actually formats it."""
+
+    __slots__ = ("user_id", "user", "guild", "channel", "data")
+
+    def __init__(self, i: Interaction):
+        self.user_id = i.user.id
+        self.user = i.user.display_name
+        self.guild = i.guild.name if i.guild is not None else None
+        self.channel = getattr(i.channel, "name", None)
+        self.data = i.data
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"user_id": self.user_id, "user": self.user, "guild": self.guild, "channel": self.channel,
+                "data": self.data}
+
+    def __str__(self) -> str:
+        fields = ", ".join(f"{key}: {value}" for key, value in (self.data or {}).items())
+        return f"{self.user} #{self.guild}-{self.channel} Data:: {fields}"
+
+
+class AuditJSONFormatter(logging.Formatter):
+    """Formats interaction audit records as one JSON object per line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        audit = getattr(record, "audit", None)
+        entry = {"time": dt.datetime.fromtimestamp(record.created).isoformat(), "level": record.levelname}
+        if isinstance(audit, InteractionAudit):
+            entry.update(audit.to_dict())
+        else:
+            entry["message"] = record.getMessage()
+        return json.dumps(entry, default=str)
+
+
+class WriteBehindBuffer:
+    """Collects unsaved model instances and inserts them with bulk_create in batches.
+
+    A batch is written every interval seconds, or as soon as max_batch instances are waiting.
+    """
+
+    def __init__(self, bot: EngFroshBot, name: str, model: Any, interval: float = 0.5, max_batch: int = 100):
+        self.bot = bot
+        self.name = name
+        self.model = model
+        self.interval = interval
+        self.max_batch = max_batch
+        self.pending: List[Any] = []
+        self.written = 0
+        self.failed = 0
+        self._full = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    def add(self, obj: Any) -> None:
+        self.pending.append(obj)
+        if len(self.pending) >= self.max_batch:
+            self._full.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+            self.bot.background_tasks.add(self._task)
+            self._task.add_done_callback(self.bot.background_tasks.discard)
+
+    async def _run(self) -> None:
+        while self.pending:
+            try:
+                await asyncio.wait_for(self._full.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    async def flush(self) -> None:
+        """Write everything that is waiting now."""
+
+        async with self._lock:
+            self._full.clear()
+            while self.pending:
+                batch = self.pending[:self.max_batch]
+                del self.pending[:len(batch)]
+                try:
+                    await self.bot.db(self.model.objects.bulk_create, batch)
+                    self.written += len(batch)
+                    self.bot.metrics.observe("write_behind_batch_size", len(batch), buffer=self.name)
+                except Exception as e:
+                    self.failed += len(batch)
+                    self.bot.error(f"Failed to write {len(batch)} {self.name} records: {e!r}", exc_info=e)
+
+    async def close(self) -> None:
+        """Drain the buffer, waiting for a batch that is already being written."""
+        await self.flush()
+        if self._task is not None and not self._task.done():
+            self._full.set()
+            await self._task
+
+    def stats(self) -> Dict[str, int]:
+        return {"pending": len(self.pending), "written": self.written, "failed": self.failed}
+
+
+class DatabaseExecutor:
+    """Bounded thread pool that all Django ORM calls from the bot and cogs run on.
+
+    Each worker thread keeps its own database connection between calls, old or broken connections are
+    closed before a call the same way Django does at the start of a request.
+    """
+
+    def __init__(self, max_workers: int = 4, metrics: Optional[Metrics] = None):
+        self.max_workers = max_workers
+        self.metrics = metrics
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix="orm")
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.calls = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _call(self, submitted: float, fn, args, kwargs):
+        wait = time.monotonic() - submitted
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+            self.calls += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+        try:
+            close_old_connections()
+            with connection.execute_wrapper(count_queries):
+                return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self.running -= 1
+
+    async def run(self, fn, *args, **kwargs):
+        with self._lock:
+            self.queued += 1
+        start = time.monotonic()
+        # Copy the context so queries are counted towards the interaction that made them
+        call = functools.partial(contextvars.copy_context().run, self._call, start, fn, args, kwargs)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, call)
+        finally:
+            if self.metrics is not None:
+                name = getattr(fn, "__qualname__", type(fn).__name__)
+                self.metrics.observe("db_call_seconds", time.monotonic() - start, function=name)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {"workers": self.max_workers, "queued": self.queued, "running": self.running,
+                    "calls": self.calls, "max_wait": self.max_wait,
+                    "avg_wait": self.total_wait / self.calls if self.calls else 0.0}
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class PermissionCache:
+    """Process wide LRU cache of Discord user id -> (is_superuser, permissions) with a TTL.
+
+    A value of None means the Discord account isn't linked to a user. Accounts can be linked from the website
+    without the bot knowing, so those are only kept for unlinked_ttl seconds.
+    """
+
+    def __init__(self, max_size: int = 2048, ttl: float = 300, unlinked_ttl: float = 5):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.unlinked_ttl = unlinked_ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[int, Tuple[float, Optional[Tuple[bool, frozenset]]]] = OrderedDict()
+        self._generation = 0
+
+    def configure(self, config: Dict[str, Any]) -> None:
+        self.max_size = config.get("max_size", self.max_size)
+        self.ttl = config.get("ttl", self.ttl)
+        self.unlinked_ttl = config.get("unlinked_ttl", self.unlinked_ttl)
+        self.clear()
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def get(self, user_id: int) -> Tuple[bool, Optional[Tuple[bool, frozenset]]]:
+        """Returns (found, identity) for the user."""
+        entry = self._entries.get(user_id)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[user_id]
+            self.misses += 1
+            return (False, None)
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        return (True, entry[1])
+
+    def put(self, user_id: int, identity: Optional[Tuple[bool, frozenset]], generation: int) -> None:
+        # Drop results that were loaded before an invalidation happened
+        if generation != self._generation:
+            return
+        ttl = self.ttl if identity is not None else self.unlinked_ttl
+        self._entries[user_id] = (time.monotonic() + ttl, identity)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        self._entries.pop(user_id, None)
+        self._generation += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._generation += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+permission_cache = PermissionCache()
+
+
+def load_identity(user_id: int) -> Optional[Tuple[bool, frozenset]]:
+    discord_user = DiscordUser.objects.select_related("user").filter(id=user_id).first()
+    if discord_user is None:
+        return None  # User account isn't linked
+    user_model = discord_user.user
+    # Matches has_perm, inactive superusers get no permissions
+    if user_model.is_active and user_model.is_superuser:
+        return (True, frozenset())
+    return (False, frozenset(user_model.get_all_permissions()))
+
+
+def split_code_blocks(text: str, limit: int = 2000) -> List[str]:
+    """Split text on line boundaries into code block messages that fit in the discord message limit."""
+
+    size = limit - len("```\n```")
+    chunks = []
+    cur = ""
+    for line in text.splitlines(keepends=True):
+        while len(line) > size:
+            # A single line longer than a message has to be hard split
+            if cur:
+                chunks.append(cur)
+                cur = ""
+            chunks.append(line[:size])
+            line = line[size:]
+        if len(cur) + len(line) > size:
+            chunks.append(cur)
+            cur = ""
+        cur += line
+    if cur or not chunks:
+        chunks.append(cur)
+    return ["```\n" + c + "```" for c in chunks]
+
+
+class Scoreboard:
+    """Debounced scoreboard that keeps one set of messages per channel and edits them in place.
+
+    Calls to request_update are coalesced, the board is rendered at most once per interval.
+    """
+
+    def __init__(self, bot: EngFroshBot, channels: List[int], render: Callable[[], Awaitable[str]],
+                 interval: float = 5):
+        self.bot = bot
+        self.channels = channels
+        self.render = render
+        self.interval = interval
+        self.renders = 0
+        self._messages: Dict[int, List[nextcord.Message]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._dirty = False
+
+    def request_update(self) -> None:
+        self._dirty = True
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+            self.bot.background_tasks.add(self._task)
+            self._task.add_done_callback(self.bot.background_tasks.discard)
+
+    async def _run(self) -> None:
+        while self._dirty:
+            await asyncio.sleep(self.interval)
+            self._dirty = False
+            try:
+                await self.update()
+            except Exception as e:
+                self.bot.error(f"Failed to update scoreboard: {e!r}", exc_info=e)
+
+    async def _get_messages(self, channel: nextcord.TextChannel, count: int) -> List[nextcord.Message]:
+        if channel.id not in self._messages:
+            # Pick up the board left behind by a previous run so it keeps being edited
+            found = []
+            async for message in channel.history(limit=count):
+                if message.author.id != self.bot.user.id:
+                    break
+                found.append(message)
+            found.reverse()
+            self._messages[channel.id] = found
+        return self._messages[channel.id]
+
+    async def update(self) -> None:
+        """Render the board and edit the messages in every channel now."""
+
+        chunks = split_code_blocks(await self.render())
+        self.renders += 1
+        for channel_id in self.channels:
+            channel = self.bot.get_channel(channel_id)
+            if channel is None:
+                self.bot.warning(f"Scoreboard channel {channel_id} not found", send_to_discord=False)
+                continue
+            try:
+                await self._update_channel(channel, chunks)
+            except nextcord.NotFound:
+                # A board message was deleted, e.g. by /purge, so find the board again and resend what's missing
+                self._messages.pop(channel.id, None)
+                await self._update_channel(channel, chunks)
+
+    async def _update_channel(self, channel: nextcord.TextChannel, chunks: List[str]) -> None:
+        messages = await self._get_messages(channel, len(chunks))
+        for idx, chunk in enumerate(chunks):
+            if idx < len(messages):
+                if messages[idx].content != chunk:
+                    messages[idx] = await messages[idx].edit(content=chunk)
+            else:
+                messages.append(await channel.send(chunk))
+        while len(messages) > len(chunks):
+            await messages.pop().delete()
+
+
+class DiscordLogSink:
+    """Bounded queue of log messages drained by a single task into the bot log channel.
+
+    Messages are coalesced into code blocks of at most 1900 characters and flushed when a block is full or
+    the flush interval has passed. Repeats of the same message are counted instead of sent again, and when
+    the queue is full new messages are dropped and counted.
+    """
+
+    BLOCK_SIZE = 1900
+
+    def __init__(self, bot: EngFroshBot, max_size: int = 500, flush_interval: float = 2):
+        self.bot = bot
+        self.flush_interval = flush_interval
+        self.queue: asyncio.Queue = asyncio.Queue(max_size)
+        self.dropped = 0
+        self.duplicates = 0
+        self.sent = 0
+        self._last: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def backlog(self) -> int:
+        return self.queue.qsize()
+
+    def stats(self) -> Dict[str, int]:
+        return {"backlog": self.backlog, "dropped": self.dropped, "duplicates": self.duplicates, "sent": self.sent}
+
+    def put(self, message: str, level: str) -> None:
+        """Queue a message, raises RuntimeError if there is no running event loop."""
+
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._run())
+        try:
+            self.queue.put_nowait((level, dt.datetime.now().isoformat(), str(message)))
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def _collect(self) -> List[Tuple[str, str, str]]:
+        entries = [await self.queue.get()]
+        size = len(entries[0][2])
+        deadline = time.monotonic() + self.flush_interval
+        while size < self.BLOCK_SIZE:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                entry = await asyncio.wait_for(self.queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            entries.append(entry)
+            size += len(entry[2])
+        return entries
+
+    def _format(self, entries: List[Tuple[str, str, str]]) -> List[str]:
+        lines: List[str] = []
+        counts: List[int] = []
+        for level, timestamp, message in entries:
+            if message == self._last and lines:
+                counts[-1] += 1
+                self.duplicates += 1
+                continue
+            self._last = message
+            lines.append(f"\n{level} {timestamp}: {message}\n")
+            counts.append(1)
+        return [line if count == 1 else line + f"(repeated {count} times)\n" for line, count in zip(lines, counts)]
+
+    async def _send(self, blocks: List[str]) -> None:
+        channel = self.bot.get_channel(self.bot.log_channel)
+        if channel is None:
+            return
+        content = ""
+        for block in blocks:
+            if len(block) >= self.BLOCK_SIZE:
+                if content:
+                    await channel.send("```" + content + "```")
+                    content = ""
+                fp = io.StringIO(block)
+                await channel.send(file=nextcord.File(fp, f"{dt.datetime.now().isoformat()}.log"))
+            elif len(content) + len(block) >= self.BLOCK_SIZE:
+                await channel.send("```" + content + "```")
+                content = block
+            else:
+                content += block
+        if content:
+            await channel.send("```" + content + "```")
+        self.sent += len(blocks)
+
+    async def _run(self) -> None:
+        while True:
+            entries = await self._collect()
+            try:
+                await self._send(self._format(entries))
+            except Exception as e:
+                logger.error(f"Failed to send logs to discord: {e!r}")
+
+
 def is_admin():
     def predicate(i: nextcord.Interaction):
         member = i.user
@@ -62,24 +494,25 @@ def is_superadmin():
 
 
 def has_permission(perm):
-    def predicate_sync(member):
-        close_old_connections()
+    async def predicate(i: nextcord.Interaction):
+        member = i.user
         if member.guild_permissions >= nextcord.Permissions(administrator=True):
             return True
         user = member.id
         superadmin = global_config['module_settings']['management']['superadmin']
         if user in superadmin:
             return True
-        discord_user = DiscordUser.objects.filter(id=user).first()
-        if discord_user is None:
+        found, identity = permission_cache.get(user)
+        if not found:
+            generation = permission_cache.generation
+            identity = await i.client.db(load_identity, user)
+            permission_cache.put(user, identity, generation)
+        if identity is None:
             return False  # User account isn't linked
-        user_model = discord_user.user
-        if user_model.is_superuser:
+        is_superuser, perms = identity
+        if is_superuser:
             return True
-        return user_model.has_perm(perm)
-
-    async def predicate(i: nextcord.Interaction):
-        return await sync_to_async(predicate_sync)(i.user)
+        return perm in perms
     return application_checks.check(predicate)
 
 
@@ -96,25 +529,69 @@ class EngFroshBot(commands.Bot):
         else:
             self.is_debug = False
         self.log_channel = log_channel
+        self.metrics = Metrics()
+        self.db_executor = DatabaseExecutor(config.get("database", {}).get("workers", 4), self.metrics)
+        log_settings = config.get("discord_log", {})
+        self.log_sink = DiscordLogSink(self, log_settings.get("max_backlog", 500),
+                                       log_settings.get("flush_interval", 2))
         self.background_tasks: Set[asyncio.Task] = set()
+        self.scoreboards: Dict[str, Scoreboard] = {}
+        self.write_buffers: Dict[str, WriteBehindBuffer] = {}
+        self.close_hooks: Dict[str, Callable[[], Awaitable[Any]]] = {}
+        self.guild_index = GuildIndex()
+        self.jobs: Dict[int, BulkJob] = {}
         global global_config
         global_config = config
+        permission_cache.configure(config.get("permission_cache", {}))
         super().__init__(description=description, default_guild_ids=[config['guild']], **options)
+        instrument_http(self.http, self.metrics)
 
-    async def _log(self, message: str, level: str = "INFO", exc_info=None) -> None:
-        """Handler for logging to bot channel"""
+    def dispatch(self, event_name: str, *args, **kwargs) -> None:
+        self.metrics.inc("gateway_events_total", event=event_name)
+        super().dispatch(event_name, *args, **kwargs)
 
-        # Send to log channels
-        content = f"\n{level} {dt.datetime.now().isoformat()}: {message}\n"
-        guild = self.get_guild(self.config['guild'])
-        channel = guild.get_channel(self.log_channel)
-        if len(content) >= 1900:
-            fp = io.StringIO(content)
-            file = nextcord.File(fp, f"{dt.datetime.now().isoformat()}.log")
-            await channel.send(file=file)
+    async def db(self, fn, *args, **kwargs):
+        """Run a synchronous function that uses the Django ORM on the database thread pool."""
+        return await self.db_executor.run(fn, *args, **kwargs)
 
-        else:
-            await channel.send("```" + content + "```")
+    async def close(self):
+        for buffer in self.write_buffers.values():
+            await buffer.close()
+        for name, hook in self.close_hooks.items():
+            try:
+                await hook()
+            except Exception as e:
+                logger.error(f"Close hook {name} failed: {e!r}")
+        await super().close()
+        self.db_executor.shutdown()
+
+    def scoreboard(self, name: str, channels: List[int], render: Callable[[], Awaitable[str]],
+                   interval: float = 5) -> Scoreboard:
+        """Get or create the named scoreboard."""
+        if name not in self.scoreboards:
+            self.scoreboards[name] = Scoreboard(self, channels, render, interval)
+        return self.scoreboards[name]
+
+    def on_close(self, name: str, hook: Callable[[], Awaitable[Any]]) -> None:
+        """Register a coroutine function to await when the bot closes, replacing any hook of the same name."""
+        self.close_hooks[name] = hook
+
+    def write_buffer(self, name: str, model: Any, interval: float = 0.5, max_batch: int = 100) -> WriteBehindBuffer:
+        """Get or create the named write behind buffer, which is drained when the bot closes."""
+        if name not in self.write_buffers:
+            self.write_buffers[name] = WriteBehindBuffer(self, name, model, interval, max_batch)
+        return self.write_buffers[name]
+
+    def start_job(self, job: BulkJob, i: Optional[Interaction] = None) -> BulkJob:
+        """Run a bulk job in the background, reporting progress on the interaction if given."""
+
+        self.jobs[job.id] = job
+        progress = interaction_progress(i) if i is not None else None
+        job.task = asyncio.create_task(job.run(progress))
+        self.background_tasks.add(job.task)
+        job.task.add_done_callback(self.background_tasks.discard)
+        job.task.add_done_callback(lambda t: self.info(job.summary(), send_to_discord=False))
+        return job
 
     def log(self, message: str, level: str = "INFO", exc_info=None, *, print_to_console=False, send_to_discord=True):
         """Log a message to the console, the logger, and the bot channels."""
@@ -138,9 +615,7 @@ class EngFroshBot(commands.Bot):
         # Send to log channels
         if send_to_discord:
             try:
-                log_task = asyncio.create_task(self._log(message, level, exc_info=exc_info))
-                self.background_tasks.add(log_task)
-                log_task.add_done_callback(self.background_tasks.discard)
+                self.log_sink.put(message, level)
             except RuntimeError as e:
                 self.error("Logging Error: No running event loop, you probably need to set send_to_discord=False",
                            exc_info=e, send_to_discord=False)
@@ -160,16 +635,18 @@ class EngFroshBot(commands.Bot):
 
     async def on_interaction(self, i: Interaction):
         # await i.response.defer()
-        close_old_connections()
-        data = i.data
-        user = i.user
-        channel = i.channel
-        guild = i.guild
-        message = user.display_name + " #" + guild.name + "-" + channel.name + " Data:: "
-        for key, value in data.items():
-            message += " " + str(key) + ": " + str(value) + ","
-        self.info(message + "\n", send_to_discord=False)
-        await self.process_application_commands(i)
+        if audit_logger.isEnabledFor(logging.INFO):
+            audit = InteractionAudit(i)
+            audit_logger.info("%s", audit, extra={"audit": audit})
+        command = (i.data or {}).get("name") or str(i.type)
+        queries = [0]
+        token = interaction_queries.set(queries)
+        try:
+            with self.metrics.timer("command_seconds", command=command):
+                await self.process_application_commands(i)
+        finally:
+            interaction_queries.reset(token)
+            self.metrics.observe("command_db_queries", queries[0], command=command)
 
     async def on_application_command_error(self, i: nextcord.Interaction, exception: Exception):
         if isinstance(exception, ApplicationCheckFailure):
@@ -186,7 +663,6 @@ class EngFroshBot(commands.Bot):
     ]
 
     async def on_message(self, message):
-        close_old_connections()
         if message.author.bot:
             return
         if "fish" in message.content.lower():
@@ -209,7 +685,26 @@ class EngFroshBot(commands.Bot):
         return message
 
     async def on_member_remove(self, member):
-        self.info(await sync_to_async(self.remove)(member.id))
+        permission_cache.invalidate(member.id)
+        self.info(await self.db(self.remove, member.id))
+
+    async def on_guild_channel_create(self, channel):
+        self.guild_index.channel_created(channel)
+
+    async def on_guild_channel_delete(self, channel):
+        self.guild_index.channel_deleted(channel)
+
+    async def on_guild_channel_update(self, before, after):
+        self.guild_index.channel_updated(before, after)
+
+    async def on_guild_role_create(self, role):
+        self.guild_index.role_created(role)
+
+    async def on_guild_role_delete(self, role):
+        self.guild_index.role_deleted(role)
+
+    async def on_guild_role_update(self, before, after):
+        self.guild_index.role_updated(before, after)
 
     def error(self, message, *, exc_info=None, **kwargs):
         self.log(message, "ERROR", exc_info=exc_info, **kwargs)
@@ -0,0 +1,196 @@
+"""Minimal stand-ins for the nextcord objects the cogs touch, so commands can run without a gateway."""
+
+from __future__ import annotations
+
+import asyncio
+import itertools
+from typing import Any, Dict, List, Optional
+
+import nextcord
+
+_ids = itertools.count(10 ** 17)
+
+
+def next_id() -> int:
+    return next(_ids)
+
+
+class FakeAPI:
+    """Counts the discord API calls made by the cogs and optionally simulates their latency."""
+
+    def __init__(self, latency: float = 0):
+        self.latency = latency
+        self.calls: Dict[str, int] = {}
+
+    async def call(self, name: str) -> None:
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    @property
+    def total(self) -> int:
+        return sum(self.calls.values())
+
+
+class FakeRole:
+    def __init__(self, guild: FakeGuild, name: str, id: Optional[int] = None):
+        self.guild = guild
+        self.id = id if id is not None else next_id()
+        self.name = name
+
+    @property
+    def members(self) -> List[FakeMember]:
+        return [m for m in self.guild.members if self in m.roles]
+
+
+class FakeMessage:
+    def __init__(self, channel: FakeChannel, content: Optional[str], author: Any):
+        self.id = next_id()
+        self.channel = channel
+        self.content = content
+        self.author = author
+
+    async def edit(self, content: Optional[str] = None, **kwargs) -> FakeMessage:
+        await self.channel.guild.api.call("message.edit")
+        self.content = content
+        return self
+
+    async def delete(self) -> None:
+        await self.channel.guild.api.call("message.delete")
+
+    async def add_reaction(self, emote: str) -> None:
+        await self.channel.guild.api.call("message.add_reaction")
+
+
+class FakeChannel:
+    def __init__(self, guild: FakeGuild, name: str, id: Optional[int] = None):
+        self.guild = guild
+        self.id = id if id is not None else next_id()
+        self.name = name
+        self.messages: List[FakeMessage] = []
+
+    async def send(self, content: Optional[str] = None, **kwargs) -> FakeMessage:
+        await self.guild.api.call("channel.send")
+        message = FakeMessage(self, content, self.guild.bot_user)
+        self.messages.append(message)
+        return message
+
+    async def history(self, limit: int = 100):
+        for message in reversed(self.messages[-limit:]):
+            yield message
+
+
+class FakeMember:
+    def __init__(self, guild: FakeGuild, name: str, id: Optional[int] = None):
+        self.guild = guild
+        self.id = id if id is not None else next_id()
+        self.name = name
+        self.discriminator = "0"
+        self.nick: Optional[str] = None
+        self.roles: List[FakeRole] = []
+        self.guild_permissions = nextcord.Permissions.none()
+        self.bot = False
+
+    @property
+    def display_name(self) -> str:
+        return self.nick or self.name
+
+    async def edit(self, nick: Optional[str] = None, **kwargs) -> None:
+        await self.guild.api.call("member.edit")
+        self.nick = nick
+
+    async def add_roles(self, *roles: FakeRole, **kwargs) -> None:
+        await self.guild.api.call("member.add_roles")
+        self.roles.extend(r for r in roles if r not in self.roles)
+
+    async def remove_roles(self, *roles: FakeRole, **kwargs) -> None:
+        await self.guild.api.call("member.remove_roles")
+        self.roles = [r for r in self.roles if r not in roles]
+
+
+class FakeGuild:
+    def __init__(self, api: FakeAPI, bot_user: Any, id: Optional[int] = None):
+        self.api = api
+        self.bot_user = bot_user
+        self.id = id if id is not None else next_id()
+        self.name = "EngFrosh Benchmark"
+        self.members: List[FakeMember] = []
+        self.roles: List[FakeRole] = []
+        # A list like nextcord's Guild.channels, with an id map for get_channel
+        self.channels: List[FakeChannel] = []
+        self._channels_by_id: Dict[int, FakeChannel] = {}
+        self.default_role = self.add_role("@everyone")
+        self.system_channel = self.add_channel("welcome")
+
+    def add_role(self, name: str) -> FakeRole:
+        role = FakeRole(self, name)
+        self.roles.append(role)
+        return role
+
+    def add_channel(self, name: str, id: Optional[int] = None) -> FakeChannel:
+        channel = FakeChannel(self, name, id)
+        self.channels.append(channel)
+        self._channels_by_id[channel.id] = channel
+        return channel
+
+    def add_member(self, name: str) -> FakeMember:
+        member = FakeMember(self, name)
+        self.members.append(member)
+        return member
+
+    def get_member(self, id: int) -> Optional[FakeMember]:
+        return next((m for m in self.members if m.id == id), None)
+
+    def get_role(self, id: int) -> Optional[FakeRole]:
+        return next((r for r in self.roles if r.id == id), None)
+
+    def get_channel(self, id: int) -> Optional[FakeChannel]:
+        return self._channels_by_id.get(id)
+
+    async def invites(self) -> List[Any]:
+        await self.api.call("guild.invites")
+        return []
+
+
+class FakeResponse:
+    def __init__(self, interaction: FakeInteraction):
+        self.interaction = interaction
+
+    async def defer(self, **kwargs) -> None:
+        await self.interaction.guild.api.call("interaction.defer")
+
+
+class FakeInteraction:
+    def __init__(self, client: Any, member: FakeMember, channel: FakeChannel, name: str,
+                 options: Optional[Dict[str, Any]] = None):
+        self.client = client
+        self.user = member
+        self.guild = member.guild
+        self.channel = channel
+        self.type = nextcord.InteractionType.application_command
+        self.data = {"name": name, "options": [{"name": k, "value": v} for k, v in (options or {}).items()]}
+        self.response = FakeResponse(self)
+        self.sent: List[str] = []
+
+    async def send(self, content: Optional[str] = None, **kwargs) -> None:
+        await self.guild.api.call("interaction.send")
+        self.sent.append(content)
+
+    async def edit_original_message(self, content: Optional[str] = None, **kwargs) -> None:
+        await self.guild.api.call("interaction.edit")
+
+
+class FakeEmoji:
+    def __init__(self, name: str):
+        self.name = name
+
+
+class FakeReaction:
+    """Stand-in for nextcord.RawReactionActionEvent."""
+
+    def __init__(self, member: FakeMember, message_id: int, emote: str):
+        self.user_id = member.id
+        self.member = member
+        self.guild_id = member.guild.id
+        self.message_id = message_id
+        self.emoji = FakeEmoji(emote)
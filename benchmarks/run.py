@@ -0,0 +1,268 @@
+"""Replay synthetic interactions through the real cogs against a seeded SQLite database.
+
+Run from the repository root with the common_models submodule checked out:
+
+    python -m benchmarks.run --teams 200 --members 1500
+
+Each scenario reports throughput, latency percentiles, DB queries per operation and Discord API calls.
+"""
+
+import argparse
+import asyncio
+import os
+import time
+from typing import Awaitable, Callable, Dict, List
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+import nextcord  # noqa: E402
+from django.conf import settings  # noqa: E402
+from django.contrib.auth.models import Group, Permission, User  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.db import transaction  # noqa: E402
+
+import common_models.models as md  # noqa: E402
+from EngFroshBot import EngFroshBot  # noqa: E402
+from metrics import interaction_queries, percentile  # noqa: E402
+from benchmarks.fake_discord import FakeAPI, FakeGuild, FakeInteraction, FakeReaction, next_id  # noqa: E402
+
+import cogs.cogCoin.coin as coin  # noqa: E402
+import cogs.cogManagement.management as management  # noqa: E402
+import cogs.cogManagement.utils as management_utils  # noqa: E402
+import cogs.cogScav.scav as scav  # noqa: E402
+
+PRONOUNS = [("He/Him", "\N{LARGE BLUE CIRCLE}"), ("She/Her", "\N{LARGE RED CIRCLE}"),
+            ("They/Them", "\N{LARGE GREEN CIRCLE}")]
+
+
+class CheckFailed(Exception):
+    """Raised when a command's permission checks fail during a benchmark."""
+
+
+class ScenarioFailed(Exception):
+    """Raised when every operation of a scenario failed, so its timings would be meaningless."""
+
+
+def reset_database() -> None:
+    name = settings.DATABASES["default"]["NAME"]
+    if os.path.exists(name):
+        os.remove(name)
+    call_command("migrate", run_syncdb=True, verbosity=0)
+
+
+@transaction.atomic
+def seed(guild: FakeGuild, teams: int, members: int) -> Dict:
+    """Create teams, linked users and pronoun options shaped like a frosh week database."""
+
+    md.BooleanSetting.objects.update_or_create(id="SCAVENGER_ENABLED", defaults={"value": True})
+    md.FroshRole.objects.get_or_create(name="Frosh")
+    facil = Group.objects.get_or_create(name="Facil")[0]
+    # Members need to guess in scav and set coin, they only become superusers if a permission is missing
+    perms = [Permission.objects.filter(codename=codename).first()
+             for codename in ("guess_scavenger_puzzle", "change_team_coin")]
+    facil.permissions.add(*[p for p in perms if p is not None])
+    superuser = any(p is None for p in perms)
+
+    puzzles = [md.Puzzle.objects.create(name=f"Puzzle {n}", answer=f"answer {n}", enabled=True,
+                                        require_photo_upload=False, puzzle_text=f"Question {n}")
+               for n in range(5)]
+
+    team_rows = []
+    for n in range(teams):
+        group = Group.objects.create(name=f"Team {n}")
+        team_rows.append(md.Team.objects.create(display_name=f"Team {n}", group=group,
+                                                scavenger_enabled_for_team=True, coin_amount=0))
+
+    team_members: Dict[int, List] = {team.id: [] for team in team_rows}
+    for n in range(members):
+        member = guild.add_member(f"member{n}")
+        team = team_rows[n % teams]
+        user = User.objects.create(username=f"member{n}", first_name="Member", last_name=str(n),
+                                   is_superuser=superuser)
+        user.groups.add(team.group, facil)
+        md.UserDetails.objects.create(user=user, name=f"Member {n}")
+        for order, (pronoun, _) in enumerate(PRONOUNS[:n % 3]):
+            md.Pronoun.objects.create(name=pronoun, order=order, user=user)
+        md.DiscordUser.objects.create(id=member.id, user=user, discord_username=member.name, discriminator=0)
+        team_members[team.id].append(member)
+
+    for team in team_rows:
+        team.refresh_scavenger_progress()
+
+    for name, emote in PRONOUNS:
+        md.PronounOption.objects.create(name=name, emote=emote)
+    pronoun_message = next_id()
+    md.DiscordMessage.objects.create(type="pronoun", id=pronoun_message)
+
+    return {"teams": team_rows, "team_members": team_members, "puzzles": puzzles,
+            "pronoun_message": pronoun_message}
+
+
+def make_bot(guild: FakeGuild, data: Dict, args) -> EngFroshBot:
+    log_channel = guild.add_channel("bot-log")
+    team_channels = [guild.add_channel(f"team-{n}").id for n in range(len(data["teams"]))]
+    config = {
+        "guild": guild.id,
+        # Photo uploads aren't benchmarked, nothing is ever sent here
+        "server": "http://127.0.0.1/",
+        "bot_log_channel": log_channel.id,
+        "database": {"workers": args.db_workers},
+        "module_settings": {
+            "management": {"superadmin": [], "spirit_role": guild.add_role("Spirit").id,
+                           "froshadmin_role": guild.add_role("Frosh Admin").id},
+            "scav": {"team_channels": team_channels, "verify_channel": guild.add_channel("verify").id,
+                     "scoreboard_channels": [guild.add_channel("scav-board").id], "incorrect_message": "",
+                     "scoreboard_interval": 1},
+            "coin": {"scoreboard_channel": guild.add_channel("coin-board").id, "scoreboard_interval": 1,
+                     "scoreboard": {"header": "Place Team Coin", "row": "{place} {team_name} {coin_amount}",
+                                    "name_length": 20, "coin_length": 8}},
+        },
+    }
+    bot = EngFroshBot(config=config, log_channel=log_channel.id, intents=nextcord.Intents.none())
+    # Nothing connects to discord, the bot only ever sees the fake guild
+    bot._connection.user = guild.bot_user
+    bot.get_guild = lambda id: guild
+    bot.get_channel = guild.get_channel
+    for cog in (scav, coin, management):
+        cog.setup(bot)
+    return bot
+
+
+async def invoke(bot: EngFroshBot, cog_name: str, command_name: str, i: FakeInteraction, **kwargs) -> None:
+    """Run a slash command's checks and callback the same way the command tree would."""
+
+    cog = bot.get_cog(cog_name)
+    command = getattr(cog, command_name)
+    for check in command.checks:
+        if not await nextcord.utils.maybe_coroutine(check, i):
+            raise CheckFailed(command_name)
+    await command.callback(cog, i, **kwargs)
+
+
+class Result:
+    def __init__(self, name: str, latencies: List[float], queries: List[int], api_calls: int, wall: float,
+                 errors: int):
+        self.name = name
+        self.latencies = latencies
+        self.queries = queries
+        self.api_calls = api_calls
+        self.wall = wall
+        self.errors = errors
+
+    def __str__(self) -> str:
+        ops = len(self.latencies)
+        ms = [x * 1000 for x in self.latencies]
+        return (f"{self.name:<16} ops={ops:<6} {ops / self.wall:8.1f} ops/s  "
+                f"p50={percentile(ms, 0.5):7.2f}ms p95={percentile(ms, 0.95):7.2f}ms "
+                f"p99={percentile(ms, 0.99):7.2f}ms  queries/op={sum(self.queries) / max(ops, 1):5.1f}  "
+                f"api calls={self.api_calls}  errors={self.errors}")
+
+
+async def run_scenario(name: str, api: FakeAPI, ops: List[Callable[[], Awaitable]],
+                       concurrency: int) -> Result:
+    latencies: List[float] = []
+    queries: List[int] = []
+    errors = 0
+    slots = asyncio.Semaphore(concurrency)
+
+    async def one(op: Callable[[], Awaitable]) -> None:
+        nonlocal errors
+        async with slots:
+            counter = [0]
+            interaction_queries.set(counter)
+            start = time.perf_counter()
+            try:
+                await op()
+            except Exception as e:
+                errors += 1
+                if errors == 1:
+                    print(f"{name}: first error: {e!r}")
+            latencies.append(time.perf_counter() - start)
+            queries.append(counter[0])
+
+    api_before = api.total
+    start = time.perf_counter()
+    await asyncio.gather(*(one(op) for op in ops))
+    wall = time.perf_counter() - start
+    if ops and errors == len(ops):
+        raise ScenarioFailed(f"All {errors} {name} operations failed")
+    return Result(name, latencies, queries, api.total - api_before, wall, errors)
+
+
+def scenarios(bot: EngFroshBot, guild: FakeGuild, data: Dict) -> Dict[str, List[Callable[[], Awaitable]]]:
+    channels = bot.config["module_settings"]["scav"]["team_channels"]
+    teams = data["teams"]
+    captains = [(data["team_members"][team.id][0], guild.get_channel(channels[n]))
+                for n, team in enumerate(teams) if data["team_members"][team.id]]
+
+    def guess(member, channel):
+        return lambda: invoke(bot, "Scav", "guess", FakeInteraction(bot, member, channel, "guess"),
+                              guess="wrong answer", file=None)
+
+    def set_coin(member, team, amount):
+        i = FakeInteraction(bot, member, guild.system_channel, "set_coin")
+        return lambda: invoke(bot, "Coin", "coin", i, team=team.display_name, amount=str(amount))
+
+    def react(member, message_id):
+        return lambda: bot.get_cog("Management").on_raw_reaction_add(
+            FakeReaction(member, message_id, PRONOUNS[member.id % len(PRONOUNS)][1]))
+
+    async def compute_names():
+        ids = [m.id for m in guild.members]
+        names = await bot.db(management_utils.compute_discord_names, ids)
+        # The batch formats names itself, make sure it still agrees with the model without counting those queries
+        token = interaction_queries.set(None)
+        try:
+            sample = await bot.db(lambda: {id: md.DiscordUser.objects.get(id=id).compute_name() for id in ids[:50]})
+        finally:
+            interaction_queries.reset(token)
+        wrong = [id for id, name in sample.items() if names.get(id) != name]
+        if wrong:
+            raise AssertionError(f"{len(wrong)} names differ from DiscordUser.compute_name")
+
+    unrelated = next_id()
+    return {
+        "guess": [guess(member, channel) for member, channel in captains],
+        "coin": [set_coin(captains[n % len(captains)][0], team, n) for n, team in enumerate(teams)],
+        "pronoun_react": [react(member, data["pronoun_message"]) for member in guild.members],
+        "reaction_miss": [react(member, unrelated) for member in guild.members],
+        "compute_names": [compute_names],
+    }
+
+
+async def main(args, api: FakeAPI, guild: FakeGuild, data: Dict) -> None:
+    bot = make_bot(guild, data, args)
+    for cog_name in ("Scav", "Coin", "Management"):
+        await bot.get_cog(cog_name).on_ready()
+
+    print(f"Seeded {args.teams} teams and {args.members} members, ORM workers: {args.db_workers}")
+    ops = scenarios(bot, guild, data)
+    for name in args.scenarios:
+        print(await run_scenario(name, api, ops[name], args.concurrency))
+
+    for buffer in bot.write_buffers.values():
+        await buffer.close()
+    bot.db_executor.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--teams", type=int, default=200)
+    parser.add_argument("--members", type=int, default=1500)
+    parser.add_argument("--concurrency", type=int, default=200, help="Operations in flight at once")
+    parser.add_argument("--db-workers", type=int, default=4)
+    parser.add_argument("--discord-latency", type=float, default=0, help="Simulated API latency in ms")
+    parser.add_argument("--scenarios", nargs="+", default=["guess", "coin", "pronoun_react", "reaction_miss"],
+                        choices=["guess", "coin", "pronoun_react", "reaction_miss", "compute_names"])
+    args = parser.parse_args()
+
+    api = FakeAPI(args.discord_latency / 1000)
+    guild = FakeGuild(api, bot_user=type("BotUser", (), {"id": next_id(), "name": "bot"})())
+    # Seeding uses the ORM directly so it has to happen before the event loop starts
+    reset_database()
+    data = seed(guild, args.teams, args.members)
+    asyncio.run(main(args, api, guild, data))
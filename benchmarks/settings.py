@@ -0,0 +1,25 @@
+"""Django settings for running the benchmarks against a local SQLite copy of the common_models schema."""
+
+import os
+import tempfile
+
+SECRET_KEY = "benchmark"
+USE_TZ = True
+DEFAULT_AUTO_FIELD = "django.db.models.AutoField"
+
+INSTALLED_APPS = [
+    "django.contrib.contenttypes",
+    "django.contrib.auth",
+    "common_models",
+]
+
+# A file is used instead of :memory: since every thread of the ORM pool opens its own connection
+DATABASES = {
+    "default": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": os.environ.get("BENCH_DB", os.path.join(tempfile.gettempdir(), "engfrosh_bench.sqlite3")),
+        "OPTIONS": {"timeout": 30},
+    }
+}
+
+MEDIA_ROOT = os.path.join(tempfile.gettempdir(), "engfrosh_bench_media")
@@ -4,13 +4,22 @@ import nextcord
 from nextcord import Intents
 import nextcord.ext.commands
 
+import atexit
 import logging
 import os
-from logging.handlers import RotatingFileHandler
+import queue
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 import sys
 import yaml
 
-from EngFroshBot import EngFroshBot
+from EngFroshBot import EngFroshBot, AuditJSONFormatter
+
+
+class LazyQueueHandler(QueueHandler):
+    """Queues records unformatted so the formatting happens on the listener thread as well."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
 
 
 def recursive_update(config: dict, type_config: dict) -> dict:
@@ -58,16 +67,19 @@ error_handler = RotatingFileHandler(ERROR_LOG_FILE, maxBytes=19 * 1024 * 1024, b
 error_handler.setLevel("ERROR")
 error_handler.setFormatter(file_formatter)
 
-logging.getLogger().setLevel("DEBUG")
-logging.getLogger().addHandler(debug_handler)
-logging.getLogger().addHandler(info_handler)
-logging.getLogger().addHandler(warning_handler)
-logging.getLogger().addHandler(error_handler)
-
 stream_handler = logging.StreamHandler(sys.stdout)
 stream_handler.setLevel(DEFAULT_LOG_LEVEL)
 stream_handler.setFormatter(file_formatter)
-logging.getLogger().addHandler(stream_handler)
+
+# Handlers run on the listener thread so disk and console writes don't block the event loop
+log_queue = queue.SimpleQueue()
+log_listener = QueueListener(log_queue, debug_handler, info_handler, warning_handler, error_handler,
+                             stream_handler, respect_handler_level=True)
+log_listener.start()
+atexit.register(log_listener.stop)
+
+logging.getLogger().setLevel("DEBUG")
+logging.getLogger().addHandler(LazyQueueHandler(log_queue))
 
 # endregion
 
@@ -112,6 +124,19 @@ if "log_level" in config:
     stream_handler.setLevel(config["log_level"].upper())
     logger.info(f"Set stream log level to: {config['log_level'].upper()}")
 
+# Interaction audit records aren't built at all unless this level is enabled
+logging.getLogger("EngFroshBot.audit").setLevel(config.get("audit_level", "INFO").upper())
+
+if "audit_log" in config:
+    audit_handler = RotatingFileHandler(config["audit_log"], maxBytes=19 * 1024 * 1024, backupCount=10)
+    audit_handler.setFormatter(AuditJSONFormatter())
+    audit_queue = queue.SimpleQueue()
+    audit_listener = QueueListener(audit_queue, audit_handler)
+    audit_listener.start()
+    atexit.register(audit_listener.stop)
+    logging.getLogger("EngFroshBot.audit").addHandler(LazyQueueHandler(audit_queue))
+    logger.info(f"Writing interaction audit log to: {config['audit_log']}")
+
 # endregion
 
 
@@ -137,11 +162,23 @@ for cog in config["modules"]["cogs"]:
 # region On Ready
 
 
+metrics_started = False
+
+
 @client.event
 async def on_ready():
     """Runs on client start"""
 
+    global metrics_started
     client.info(f"Logged on as {client.user}")
+    # on_ready fires again after every reconnect, the metrics server is only started the first time
+    if "metrics" in config and not metrics_started:
+        metrics_started = True
+        host, port = config["metrics"].get("host", "127.0.0.1"), config["metrics"].get("port", 9108)
+        try:
+            await client.metrics.serve(host, port)
+        except OSError as e:
+            client.log(f"Failed to serve metrics on {host}:{port}: {e}", level="ERROR")
     await client.change_presence(activity=nextcord.Game(name="Welcome to EngFrosh!", type=1, url="mars.engfrosh.com"))
 
 # endregion
@@ -0,0 +1,114 @@
+"""Background bulk operations over many discord objects with bounded concurrency."""
+
+from __future__ import annotations
+
+import asyncio
+import itertools
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+import nextcord
+
+logger = logging.getLogger("Bulk")
+
+_job_ids = itertools.count(1)
+
+
+class BulkJob:
+    """A named batch of actions that runs in the background and can be queried or resumed.
+
+    Requests made by the actions still go through nextcord's HTTP client which waits on the per route
+    rate limit buckets, the concurrency limit keeps a job from flooding a bucket with queued requests.
+    """
+
+    def __init__(self, name: str, targets: Iterable[Tuple[Hashable, Any]],
+                 action: Callable[[Any], Awaitable[Any]], *, concurrency: int = 5):
+        self.id = next(_job_ids)
+        self.name = name
+        self.action = action
+        self.concurrency = concurrency
+        self.targets: Dict[Hashable, Any] = dict(targets)
+        self.pending: Dict[Hashable, Any] = dict(self.targets)
+        self.total = len(self.targets)
+        self.done: List[Hashable] = []
+        self.failed: Dict[Hashable, str] = {}
+        self.status = "queued"
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+
+    async def _worker(self, queue: asyncio.Queue) -> None:
+        while True:
+            try:
+                key, target = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                await self.action(target)
+                self.done.append(key)
+            except Exception as e:
+                self.failed[key] = repr(e)
+                logger.warning(f"Job {self.id} {self.name} failed on {key}: {e!r}")
+            self.pending.pop(key, None)
+
+    async def run(self, progress: Optional[Callable[[BulkJob], Awaitable[None]]] = None,
+                  interval: float = 5) -> None:
+        """Run every pending target, calling progress at most once per interval and at the end."""
+
+        self.status = "running"
+        self.started_at = time.monotonic()
+        self.finished_at = None
+        queue: asyncio.Queue = asyncio.Queue()
+        for item in list(self.pending.items()):
+            queue.put_nowait(item)
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(max(1, self.concurrency))]
+        try:
+            while not all(w.done() for w in workers):
+                await asyncio.wait(workers, timeout=interval)
+                if progress is not None and not all(w.done() for w in workers):
+                    await progress(self)
+            self.status = "finished"
+        except asyncio.CancelledError:
+            self.status = "cancelled"
+            for w in workers:
+                w.cancel()
+            raise
+        finally:
+            self.finished_at = time.monotonic()
+        if progress is not None:
+            await progress(self)
+
+    def retry_failed(self) -> None:
+        """Queue failed targets to be run again on the next run."""
+        for key in self.failed:
+            self.pending[key] = self.targets[key]
+        self.failed.clear()
+
+    def summary(self) -> str:
+        msg = f"Job {self.id} ({self.name}): {self.status}, {len(self.done)}/{self.total} done"
+        if self.failed:
+            msg += f", {len(self.failed)} failed"
+        if self.pending and self.status != "running":
+            msg += f", {len(self.pending)} pending"
+        if self.started_at is not None:
+            end = self.finished_at if self.finished_at is not None else time.monotonic()
+            msg += f" in {end - self.started_at:.1f}s"
+        return msg
+
+
+def interaction_progress(i: nextcord.Interaction) -> Callable[[BulkJob], Awaitable[None]]:
+    """Progress callback that edits the deferred interaction response with the job summary."""
+
+    expired = False
+
+    async def progress(job: BulkJob) -> None:
+        nonlocal expired
+        if expired:
+            return
+        try:
+            await i.edit_original_message(content=job.summary())
+        except nextcord.HTTPException:
+            # The interaction token only lasts 15 minutes, the job keeps running without updates
+            expired = True
+    return progress
@@ -2,8 +2,8 @@ import logging
 from nextcord.ext import commands
 from nextcord import slash_command, Interaction
 from EngFroshBot import EngFroshBot, has_permission
+from leaderboard import Leaderboard
 from common_models.models import Team
-from asgiref.sync import sync_to_async
 
 logger = logging.getLogger("Cogs.Coin")
 
@@ -12,17 +12,22 @@ class Coin(commands.Cog):
     def __init__(self, bot: EngFroshBot) -> None:
         self.bot = bot
         self.config = bot.config["module_settings"]["coin"]
+        self.leaderboard = Leaderboard()
+        self.board = bot.scoreboard("coin", [self.config["scoreboard_channel"]], self.render_coin_board,
+                                    interval=self.config.get("scoreboard_interval", 5))
 
     @slash_command(name="set_coin", description="Changes a team's coin value")
     @has_permission("common_models.change_team_coin")
     async def coin(self, i: Interaction, team, amount):
         """Change team's coin: coin [team] [amount]"""
-        res = await sync_to_async(self.update_coin_amount)(int(amount), team)
+        res = await self.bot.db(self.update_coin_amount, int(amount), team)
 
-        if res:
+        if res is not None:
+            if self.leaderboard.seeded:
+                self.leaderboard.update(res.id, res.display_name, res.coin_amount)
             # TODO change so it sends to that team's update channel
             await i.send(f"{team} You got {amount} scoin!")
-            await self.update_coin_board(i)
+            self.board.request_update()
         else:
             await i.send(f"Sorry, no team called {team}, please try again.", ephemeral=True)
 
@@ -30,55 +35,42 @@ class Coin(commands.Cog):
         teams = Team.objects.filter(display_name__iexact=team)
         team_data = teams.first()
         if team_data is None:
-            return False
+            return None
         team_data.coin_amount = amount
         team_data.save()
-        return True
+        return team_data
 
     def get_all_frosh_teams(self):
         return list(Team.objects.all())
 
-    async def update_coin_board(self, i: Interaction):
-        """Update the coin standings channel."""
+    @commands.Cog.listener()
+    async def on_ready(self):
+        if not self.leaderboard.seeded:
+            await self.seed_leaderboard()
 
-        logger.debug("Updating coin board...")
-        teams = await sync_to_async(self.get_all_frosh_teams)()
+    async def seed_leaderboard(self):
+        teams = await self.bot.db(self.get_all_frosh_teams)
+        self.leaderboard.seed((team.id, team.display_name, team.coin_amount) for team in teams)
 
-        teams.sort(key=lambda team: team.coin_amount, reverse=True)
+    async def render_coin_board(self) -> str:
+        """Render the coin standings."""
 
-        msg = f"```\n{self.config['scoreboard']['header']}\n"
+        logger.debug("Rendering coin board...")
+        if not self.leaderboard.seeded:
+            await self.seed_leaderboard()
+
+        msg = f"{self.config['scoreboard']['header']}\n"
         name_padding = self.config['scoreboard']['name_length']
         coin_padding = self.config['scoreboard']['coin_length']
 
-        cur_place = 0
-        cur_coin = None
-        next_place = 1
-
-        for team in teams:
+        for place, team_name, coin_amount in self.leaderboard.standings():
             s = f"{self.config['scoreboard']['row']}\n"
-
-            team_name = team.display_name
-            coin_amount = team.coin_amount
-
-            if coin_amount == cur_coin:
-                # If there is a tie
-                place = cur_place
-                next_place += 1
-            else:
-                place = next_place
-                cur_place = next_place
-                next_place += 1
-                cur_coin = coin_amount
-
             msg += s.format(
                 place=place, team_name=f"{team_name}{' ' * (name_padding - len(str(team_name)))}",
                 coin_amount=f"{coin_amount}{' ' * (coin_padding - len(str(coin_amount)))}")
-        msg += "```"
 
         logger.debug(f"Got coin message: {msg}")
-        channel = self.config["scoreboard_channel"]
-        logger.debug(f"Sending to: {channel}")
-        await i.guild.get_channel(channel).send(msg)
+        return msg
 
 
 def setup(bot):
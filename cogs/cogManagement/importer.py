@@ -0,0 +1,89 @@
+"""Helpers for importing users from a CSV file and emailing them their invites."""
+
+import asyncio
+import csv
+import io
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+from typing import Any, Callable, List, Optional, Tuple
+
+import boto3
+from botocore.exceptions import ClientError
+
+from ratelimit import TokenBucket
+
+
+@dataclass(frozen=True)
+class ImportRow:
+    line: int
+    name: str
+    role: Any
+    email: str
+
+
+def parse_rows(data: bytes, get_role: Callable[[str], Optional[Any]]) -> Tuple[List[ImportRow], List[str]]:
+    """Parse and validate every "name,role,email" row, returning the rows and a list of errors."""
+
+    rows = []
+    errors = []
+    lines = io.StringIO(data.decode("UTF-8"))
+    for line, split in enumerate(csv.reader(lines), start=1):
+        if not split or not "".join(split).strip():
+            continue
+        if len(split) < 3:
+            errors.append(f"Line {line}: expected name, role and email")
+            continue
+        name, role_name, email = (s.strip() for s in split[:3])
+        role = get_role(role_name)
+        if role is None:
+            errors.append(f"Line {line}: invalid role \"{role_name}\"")
+        if "@" not in email:
+            errors.append(f"Line {line}: invalid email \"{email}\"")
+        if role is not None and "@" in email:
+            rows.append(ImportRow(line, name, role, email))
+    return (rows, errors)
+
+
+class EmailError(Exception):
+    """Exception raised when SES refuses to send an email."""
+
+
+class Mailer:
+    """Sends emails through SES from a pool of worker threads, limited by a token bucket."""
+
+    CHARSET = "UTF-8"
+
+    def __init__(self, sender: str, subject: str, text: str, html: str, *, region: str = "us-east-2",
+                 rate: float = 10, workers: int = 4):
+        self.sender = sender
+        self.subject = subject
+        self.text = text
+        self.html = html
+        # The endpoint can be pointed at a local SES stand-in with AWS_ENDPOINT_URL
+        self.client = boto3.client('ses', region_name=region)
+        self.bucket = TokenBucket(rate)
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix="ses")
+
+    def _send(self, email: str, link: str) -> None:
+        try:
+            self.client.send_email(
+                Destination={'ToAddresses': [email]},
+                Message={
+                    'Body': {
+                        'Html': {'Charset': self.CHARSET, 'Data': self.html.format(link=link)},
+                        'Text': {'Charset': self.CHARSET, 'Data': self.text.format(link=link)},
+                    },
+                    'Subject': {'Charset': self.CHARSET, 'Data': self.subject},
+                },
+                Source=self.sender
+            )
+        except ClientError as e:
+            raise EmailError(e.response['Error']['Message'])
+
+    async def send(self, email: str, link: str) -> None:
+        await self.bucket.acquire()
+        await asyncio.get_running_loop().run_in_executor(self.pool, partial(self._send, email, link))
+
+    def close(self) -> None:
+        self.pool.shutdown(wait=False)
@@ -0,0 +1,236 @@
+"""Declarative server layout: roles, categories and channels described in YAML and applied as a diff.
+
+Example, a category with a text and a voice channel for every team:
+
+    roles:
+      - name: Facil
+        hoist: true
+        mentionable: true
+        permissions: {read_messages: true, send_messages: true}
+    categories:
+      - name: "{each}"
+        for_each: teams
+        overwrites:
+          "@everyone": {view_channel: false}
+          "{each}": {view_channel: true}
+        channels:
+          - name: "{each}-chat"
+          - name: "{each} voice"
+            type: voice
+
+for_each is either a list of strings or "teams", the discord names of every team in common_models.
+Overwrites listed for a category or channel replace its role overwrites, member overwrites are kept.
+Anything the layout doesn't mention is left alone, nothing is ever deleted.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import yaml
+from nextcord import Guild, Member, PermissionOverwrite, Permissions, Role
+
+from guild_index import GuildIndex
+import cogs.cogManagement.utils as utils
+
+ROLES, CATEGORIES, CHANNELS = range(3)
+PHASE_NAMES = {ROLES: "roles", CATEGORIES: "categories", CHANNELS: "channels"}
+CHANNEL_TYPES = ("text", "voice")
+
+
+class LayoutError(Exception):
+    """Exception raised when the layout file is invalid or refers to something that doesn't exist."""
+
+
+@dataclass
+class Operation:
+    phase: int
+    description: str
+    run: Callable[[], Awaitable[Any]]
+
+
+def load_layout(path: str) -> Dict:
+    with open(path) as f:
+        spec = yaml.load(f, Loader=yaml.SafeLoader) or {}
+    if not isinstance(spec, dict):
+        raise LayoutError("The layout must be a mapping of roles and categories")
+    return spec
+
+
+def _substitute(value: Any, each: str) -> Any:
+    if isinstance(value, str):
+        return value.replace("{each}", each)
+    if isinstance(value, list):
+        return [_substitute(v, each) for v in value]
+    if isinstance(value, dict):
+        return {_substitute(k, each): _substitute(v, each) for k, v in value.items()}
+    return value
+
+
+def expand(items: Optional[List[Dict]], teams: List[str]) -> List[Dict]:
+    """Repeat every item with a for_each once per value, filling in {each}."""
+
+    expanded = []
+    for item in items or []:
+        if "name" not in item:
+            raise LayoutError(f"Missing name in {item}")
+        for_each = item.get("for_each")
+        if for_each is None:
+            expanded.append(item)
+            continue
+        values = teams if for_each == "teams" else for_each
+        if not isinstance(values, list):
+            raise LayoutError(f"for_each of {item['name']} must be \"teams\" or a list")
+        for each in values:
+            copy = _substitute({k: v for k, v in item.items() if k != "for_each"}, str(each))
+            expanded.append(copy)
+    return expanded
+
+
+def _permissions(spec: Dict[str, bool], name: str) -> Permissions:
+    try:
+        return Permissions(**spec)
+    except TypeError as e:
+        raise LayoutError(f"Invalid permissions for {name}: {e}")
+
+
+def _overwrite(spec: Dict[str, bool], name: str) -> PermissionOverwrite:
+    try:
+        return PermissionOverwrite(**spec)
+    except (TypeError, ValueError) as e:
+        raise LayoutError(f"Invalid overwrite for {name}: {e}")
+
+
+class LayoutPlanner:
+    """Computes the operations that bring the guild in line with the layout.
+
+    Roles and categories are created before the channels and overwrites that use them, the operations of one
+    phase don't depend on each other and can run concurrently.
+    """
+
+    def __init__(self, guild: Guild, index: GuildIndex, spec: Dict, teams: List[str]):
+        self.guild = guild
+        self.index = index
+        self.roles = expand(spec.get("roles"), teams)
+        self.categories = expand(spec.get("categories"), teams)
+        for category in self.categories:
+            category["channels"] = expand(category.get("channels"), teams)
+        # Roles and categories created while applying, before their gateway events reach the index
+        self.created: Dict[str, Any] = {}
+
+    def role(self, name: str) -> Role:
+        role = self.created.get("role:" + name.lower()) or self.index.role(self.guild, name)
+        if role is None:
+            raise LayoutError(f"Cannot find role {name}")
+        return role
+
+    def category(self, name: str):
+        return self.created.get("category:" + name.lower()) or self.index.category(self.guild, name)
+
+    def overwrites(self, spec: Dict[str, Dict[str, bool]], existing: Optional[Dict] = None) -> Dict:
+        # Member overwrites aren't part of the layout and are kept
+        overwrites = {k: v for k, v in (existing or {}).items() if isinstance(k, Member)}
+        for name, perms in spec.items():
+            overwrites[self.role(name)] = _overwrite(perms, name)
+        return overwrites
+
+    def _overwrites_differ(self, spec: Dict[str, Dict[str, bool]], existing: Dict) -> bool:
+        current = {k.id: v for k, v in existing.items() if isinstance(k, Role)}
+        desired = {}
+        for name, perms in spec.items():
+            role = self.index.role(self.guild, name)
+            if role is None:
+                return True
+            desired[role.id] = _overwrite(perms, name)
+        return current != desired
+
+    def _role_ops(self, spec: Dict) -> List[Operation]:
+        name = spec["name"]
+        options = {k: spec[k] for k in ("hoist", "mentionable") if k in spec}
+        if "permissions" in spec:
+            options["permissions"] = _permissions(spec["permissions"], name)
+        role = self.index.role(self.guild, name)
+        if role is None:
+            async def create():
+                self.created["role:" + name.lower()] = await self.guild.create_role(name=name, **options)
+            return [Operation(ROLES, f"create role {name}", create)]
+        changed = {k: v for k, v in options.items() if getattr(role, k) != v}
+        if not changed:
+            return []
+
+        async def edit():
+            await role.edit(**changed)
+        return [Operation(ROLES, f"update role {name} ({', '.join(changed)})", edit)]
+
+    def _category_ops(self, spec: Dict) -> List[Operation]:
+        name = spec["name"]
+        overwrites = spec.get("overwrites")
+        category = self.index.category(self.guild, name)
+        if category is None:
+            async def create():
+                created = await self.guild.create_category(name=name, overwrites=self.overwrites(overwrites or {}))
+                self.created["category:" + name.lower()] = created
+            return [Operation(CATEGORIES, f"create category {name}", create)]
+        if overwrites is None or not self._overwrites_differ(overwrites, category.overwrites):
+            return []
+
+        async def edit():
+            await category.edit(overwrites=self.overwrites(overwrites, category.overwrites))
+        return [Operation(CATEGORIES, f"update overwrites of category {name}", edit)]
+
+    def _channel_ops(self, category_name: str, spec: Dict) -> List[Operation]:
+        kind = spec.get("type", "text")
+        if kind not in CHANNEL_TYPES:
+            raise LayoutError(f"Invalid type {kind} for channel {spec['name']}, must be one of {CHANNEL_TYPES}")
+        name = utils.text_channel_name(spec["name"]) if kind == "text" else spec["name"]
+        overwrites = spec.get("overwrites")
+        category = self.index.category(self.guild, category_name)
+        channel = None
+        if category is not None:
+            if kind == "text":
+                channel = self.index.text_channel(self.guild, category, name)
+            else:
+                channel = self.index.voice_channel(self.guild, category, name)
+        if channel is None:
+            async def create():
+                create_channel = self.guild.create_text_channel if kind == "text" else self.guild.create_voice_channel
+                options = {}
+                if overwrites is not None:
+                    options["overwrites"] = self.overwrites(overwrites)
+                await create_channel(name, category=self.category(category_name), **options)
+            return [Operation(CHANNELS, f"create {kind} channel {name} in {category_name}", create)]
+        if overwrites is None or not self._overwrites_differ(overwrites, channel.overwrites):
+            return []
+
+        async def edit():
+            await channel.edit(overwrites=self.overwrites(overwrites, channel.overwrites))
+        return [Operation(CHANNELS, f"update overwrites of {name} in {category_name}", edit)]
+
+    def _check_roles(self, spec: Dict) -> None:
+        declared = {role["name"].lower() for role in self.roles}
+        for name in (spec.get("overwrites") or {}):
+            if name.lower() not in declared and self.index.role(self.guild, name) is None:
+                raise LayoutError(f"Overwrites of {spec['name']} use role {name}, which doesn't exist")
+
+    def plan(self) -> List[Operation]:
+        for category in self.categories:
+            self._check_roles(category)
+            for channel in category["channels"]:
+                self._check_roles(channel)
+        ops = []
+        for role in self.roles:
+            ops += self._role_ops(role)
+        for category in self.categories:
+            ops += self._category_ops(category)
+            for channel in category["channels"]:
+                ops += self._channel_ops(category["name"], channel)
+        return ops
+
+
+def describe(ops: List[Operation]) -> str:
+    counts = {phase: sum(1 for op in ops if op.phase == phase) for phase in PHASE_NAMES}
+    response = f"{len(ops)} operations: " + ", ".join(f"{n} {PHASE_NAMES[p]}" for p, n in counts.items()) + "\n"
+    for op in ops:
+        response += f"- {op.description}\n"
+    return response
@@ -1,22 +1,25 @@
 """Discord Management COG."""
 
+import asyncio
 import logging
-from typing import Optional
+import os
+from typing import Dict, Optional, Set, Tuple
 # from typing import List
 from nextcord.ext import commands
-from nextcord import slash_command, Interaction, PermissionOverwrite, TextChannel, Role, Permissions
-from nextcord import Attachment, Member
-from asgiref.sync import sync_to_async
-import time
+from nextcord import slash_command, Interaction, PermissionOverwrite, TextChannel, VoiceChannel, Role, Permissions
+from nextcord import Attachment, Member, Invite
 from django.contrib.auth.models import Permission, Group
+import yaml
 
 from common_models.models import RoleInvite, DiscordUser, DiscordRole, Team, DiscordChannel, Setting
 
-from EngFroshBot import EngFroshBot, is_admin, has_permission, is_superadmin
-import boto3
-from botocore.exceptions import ClientError
+from EngFroshBot import EngFroshBot, is_admin, has_permission, is_superadmin, permission_cache, split_code_blocks
+from bulk import BulkJob
+from ratelimit import TokenBucket
 
 import cogs.cogManagement.utils as utils
+import cogs.cogManagement.importer as importer
+import cogs.cogManagement.layout as layout
 
 logger = logging.getLogger("CogManagement")
 
@@ -28,6 +31,27 @@ class Management(commands.Cog):
         """Management COG init"""
         self.bot = bot
         self.config = bot.config["module_settings"]["management"]
+        self.bulk_concurrency = self.config.get("bulk_concurrency", 5)
+        # Invite code -> uses when last seen, diffed on join to find the invite that was used
+        self.invite_uses: Dict[str, int] = {}
+        self.role_invites: Dict[str, RoleInvite] = {}
+        self.mailer: Optional[importer.Mailer] = None
+        self.invite_lock = asyncio.Lock()
+        # (message id, emote) -> role id, and the pronoun message ids, so unrelated reactions skip the DB
+        self.reaction_roles: Optional[Dict[Tuple[int, str], int]] = None
+        self.pronoun_messages: Set[int] = set()
+
+    async def load_reaction_tables(self):
+        self.reaction_roles = await self.bot.db(utils.get_reaction_roles)
+        self.pronoun_messages = await self.bot.db(utils.get_message_ids, "pronoun")
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        guild = self.bot.get_guild(self.bot.config['guild'])
+        async with self.invite_lock:
+            self.invite_uses = {invite.id: invite.uses or 0 for invite in await guild.invites()}
+        self.role_invites = await self.bot.db(utils.get_role_invites)
+        await self.load_reaction_tables()
 
     @slash_command(name="send_role_message",
                    description="Sends a message to this channel for users to select a role")
@@ -39,7 +63,9 @@ class Management(commands.Cog):
         message = await i.channel.send(message)
 
         await message.add_reaction(emote)
-        await sync_to_async(utils.register_role_message)(emote, role.id, message.id)
+        await self.bot.db(utils.register_role_message, emote, role.id, message.id)
+        if self.reaction_roles is not None:
+            self.reaction_roles[(message.id, emote)] = role.id
 
         await i.send("Successfully created message!", ephemeral=True)
 
@@ -47,7 +73,9 @@ class Management(commands.Cog):
     @is_admin()
     async def bulk_rename(self, i: Interaction, pattern: str, replacement: str):
         await i.response.defer(ephemeral=True)
-        for c in i.guild.text_channels:
+        for c in self.bot.guild_index.channels(i.guild):
+            if not isinstance(c, TextChannel):
+                continue
             nsplit = c.name.split("-", 1)
             if len(nsplit) < 2:
                 continue
@@ -66,22 +94,29 @@ class Management(commands.Cog):
         return types
 
     def get_teams(self):
-        teams = Team.objects.all()
-        roles = {}
+        """Team names mapped to their role ids per type and their category id, in a fixed number of queries."""
+
         types = self.get_types()
+        teams = list(Team.objects.all())
+        # Mirror .first() by keeping the lowest id per team, and per team group and type
+        cat_ids = {}
+        for team_id, cat_id in DiscordChannel.objects.filter(type=4, team__in=teams) \
+                .order_by("id").values_list("team_id", "id"):
+            cat_ids.setdefault(team_id, cat_id)
+        role_ids = {}
+        for group_id, type_id, role_id in DiscordRole.objects \
+                .filter(group_id__in=[team.group_id for team in teams], secondary_group_id__in=[t[1] for t in types]) \
+                .order_by("id").values_list("group_id", "secondary_group_id", "role_id"):
+            role_ids.setdefault((group_id, type_id), role_id)
+
+        roles = {}
         cats = {}
         for team in teams:
-            cat = DiscordChannel.objects.filter(team=team, type=4).first()
-            if cat is None:
+            if team.id not in cat_ids:
                 continue
-            cats[team.discord_name] = cat.id
-            t_roles = []
-            for t in types:
-                t_roles += [DiscordRole.objects.filter(group_id=team.group, secondary_group_id=t[1]).first().role_id]
-            roles[team.discord_name] = t_roles
-        type_names = []
-        for t in types:
-            type_names += [t[0]]
+            cats[team.discord_name] = cat_ids[team.id]
+            roles[team.discord_name] = [role_ids.get((team.group_id, t[1].id)) for t in types]
+        type_names = [t[0] for t in types]
         return (type_names, roles, cats)
 
     @slash_command(name="teamchannel", description="Creates a channel for all teams")
@@ -93,22 +128,16 @@ class Management(commands.Cog):
         if team_role not in ["Head", "Facil", "Frosh"]:
             await i.send("Invalid team role! Note they must be in the format \"Head\", etc", ephemeral=True)
             return
-        team_data = await sync_to_async(self.get_teams)()
-        types = team_data[0]
-        for j in range(len(types)):
-            t = types[j]
-            if t == team_role:
-                index = j
-                break
-        if index == -1:
-            await i.send("Unable to find team role!", ephemeral=True)
-        teams = team_data[1]
-        cats = team_data[2]
+        types, teams, cats = await self.bot.db(self.get_teams)
+        index = types.index(team_role)
         perms = {}
         perms[i.guild.default_role] = PermissionOverwrite(read_messages=False)
         for r in [role1, role2, role3, i.guild.get_role(self.config['froshadmin_role'])]:
             if r is not None:
                 perms[r] = PermissionOverwrite(read_messages=True)
+
+        # Only plan the channels that don't exist yet, so running it again after a crash resumes it
+        targets = {}
         for team, roles in teams.items():
             cat = i.guild.get_channel(cats[team])
             if suffix is None:
@@ -119,12 +148,64 @@ class Management(commands.Cog):
                     name += "-" + role3.name
             else:
                 name = team + "-" + suffix
+            key = (cat.id if cat is not None else None, utils.text_channel_name(name))
+            if self.bot.guild_index.text_channel(i.guild, cat, key[1]) is not None:
+                continue
             cperms = perms.copy()
-            for j in range(index, len(types)):
-                r = i.guild.get_role(roles[j])
-                cperms[r] = PermissionOverwrite(read_messages=True)
+            for role_id in roles[index:]:
+                r = i.guild.get_role(role_id) if role_id is not None else None
+                if r is not None:
+                    cperms[r] = PermissionOverwrite(read_messages=True)
+            targets[key] = (name, cat, cperms)
+
+        if not targets:
+            await i.send("All team channels already exist!", ephemeral=True)
+            return
+
+        async def action(target):
+            name, cat, cperms = target
             await i.guild.create_text_channel(name, category=cat, overwrites=cperms)
-        await i.send("Created channels!", ephemeral=True)
+        await i.send(f"Creating {len(targets)} channels, {len(teams) - len(targets)} already exist.", ephemeral=True)
+        self.bot.start_job(BulkJob("team channels", targets.items(), action, concurrency=self.bulk_concurrency), i)
+
+    def get_team_names(self):
+        return [team.discord_name for team in Team.objects.all()]
+
+    @slash_command(name="apply_layout", description="Creates or updates roles and channels from the layout file")
+    @is_admin()
+    async def apply_layout(self, i: Interaction, dry_run: bool = True):
+        await i.response.defer(with_message=True, ephemeral=True)
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..",
+                            self.config.get("layout_file", "config/layout.yaml"))
+        try:
+            spec = layout.load_layout(path)
+            teams = await self.bot.db(self.get_team_names)
+            ops = layout.LayoutPlanner(i.guild, self.bot.guild_index, spec, teams).plan()
+        except (OSError, yaml.YAMLError, layout.LayoutError) as e:
+            await i.send(f"Invalid layout: {e}", ephemeral=True)
+            return
+
+        response = layout.describe(ops)
+        if dry_run or not ops:
+            for chunk in split_code_blocks(response):
+                await i.send(chunk, ephemeral=True)
+            return
+        await i.send(response.split("\n", 1)[0], ephemeral=True)
+        # Each phase only starts once everything it depends on exists
+        for phase, phase_name in layout.PHASE_NAMES.items():
+            targets = [(op.description, op) for op in ops if op.phase == phase]
+            if not targets:
+                continue
+
+            async def action(op: layout.Operation):
+                await op.run()
+            job = self.bot.start_job(BulkJob(f"layout {phase_name}", targets, action,
+                                             concurrency=self.bulk_concurrency), i)
+            await job.task
+            if job.failed:
+                await i.send(f"Stopped after {phase_name} failed, see /job_status {job.id}", ephemeral=True)
+                return
+        await i.send("Applied layout!", ephemeral=True)
 
     @slash_command(name="purge", description="Purge all messages from this channel.")
     @has_permission("common_models.purge_channels")
@@ -145,20 +226,18 @@ class Management(commands.Cog):
     async def spirit_on_duty(self, i: Interaction, user1: Optional[Member] = None, user2: Optional[Member] = None,
                              user3: Optional[Member] = None, user4: Optional[Member] = None,
                              user5: Optional[Member] = None):
+        await i.response.defer(ephemeral=True)
         role = i.guild.get_role(self.config['spirit_role'])
-        for m in role.members:
-            await m.remove_roles(role)
-        if user1 is not None:
-            await user1.add_roles(role)
-        if user2 is not None:
-            await user2.add_roles(role)
-        if user3 is not None:
-            await user3.add_roles(role)
-        if user4 is not None:
-            await user4.add_roles(role)
-        if user5 is not None:
-            await user5.add_roles(role)
-        await i.send("Changed spirit on duty!", ephemeral=True)
+        new = {u.id: u for u in [user1, user2, user3, user4, user5] if u is not None}
+        targets = {m.id: m for m in role.members}
+        targets.update(new)
+
+        async def action(m: Member):
+            if m.id not in new:
+                await m.remove_roles(role)
+            elif role not in m.roles:
+                await m.add_roles(role)
+        self.bot.start_job(BulkJob("spirit on duty", targets.items(), action, concurrency=self.bulk_concurrency), i)
 
     def get_all_non_kick(self):
         groups = Setting.objects.get_or_create(id="nokick_groups",
@@ -176,31 +255,78 @@ class Management(commands.Cog):
     @is_admin()
     async def kick_all(self, i: Interaction, dry_run: bool = False):
         await i.response.defer(ephemeral=True)
-        non_planning = await sync_to_async(self.get_all_non_kick)()
+        non_planning = await self.bot.db(self.get_all_non_kick)
         guild = i.guild
         if not dry_run:
-            for user in non_planning:
-                try:
-                    await guild.get_member(user).kick(reason="Frosh is over!")
-                except Exception:
-                    pass
+            members = [guild.get_member(user) for user in non_planning]
+            targets = [(m.id, m) for m in members if m is not None]
+
+            async def action(m: Member):
+                await m.kick(reason="Frosh is over!")
+            self.bot.start_job(BulkJob("kick all", targets, action, concurrency=self.bulk_concurrency), i)
         else:
             print(non_planning)
-        await i.send("Kicked all users!", ephemeral=True)
+            await i.send("Kicked all users!", ephemeral=True)
 
     @slash_command(name="add_role_to_role", description="Adds a role to every user with a role")
     @is_admin()
     async def add_role_to_role(self, i: Interaction, target_role: Role, add_role: Role):
-        members = target_role.members
-        for member in members:
-            await member.add_roles(add_role)
-        await i.send("Added role to all users with a role", ephemeral=True)
+        await i.response.defer(ephemeral=True)
+        targets = [(m.id, m) for m in target_role.members if add_role not in m.roles]
+
+        async def action(m: Member):
+            await m.add_roles(add_role)
+        self.bot.start_job(BulkJob(f"add {add_role.name} to {target_role.name}", targets, action,
+                                   concurrency=self.bulk_concurrency), i)
+
+    @slash_command(name="job_status", description="Shows the status of bulk jobs")
+    @is_admin()
+    async def job_status(self, i: Interaction, job_id: Optional[int] = None):
+        if job_id is not None:
+            job = self.bot.jobs.get(job_id)
+            if job is None:
+                await i.send("Cannot find job!", ephemeral=True)
+                return
+            response = job.summary()
+            for key, error in list(job.failed.items())[:20]:
+                response += f"\n- {key}: {error}"
+        else:
+            response = "\n".join(job.summary() for job in self.bot.jobs.values()) or "No jobs have been run."
+        await i.send(response[:2000], ephemeral=True)
+
+    @slash_command(name="job_resume", description="Reruns the failed and unfinished parts of a bulk job")
+    @is_admin()
+    async def job_resume(self, i: Interaction, job_id: int):
+        job = self.bot.jobs.get(job_id)
+        if job is None:
+            await i.send("Cannot find job!", ephemeral=True)
+            return
+        if job.status == "running":
+            await i.send("Job is still running!", ephemeral=True)
+            return
+        await i.response.defer(ephemeral=True)
+        job.retry_failed()
+        self.bot.start_job(job, i)
+
+    @slash_command(name="stats", description="Shows latency and performance statistics")
+    @is_admin()
+    async def stats(self, i: Interaction):
+        response = self.bot.metrics.render_text() + "\n"
+        response += f"Permission cache: {permission_cache.stats()}\n"
+        response += f"Database pool: {self.bot.db_executor.stats()}\n"
+        response += f"Discord log: {self.bot.log_sink.stats()}\n"
+        for name, buffer in self.bot.write_buffers.items():
+            response += f"Write buffer {name}: {buffer.stats()}\n"
+        chunks, chunk_size = len(response), 1950
+        chunk_list = [response[i:i+chunk_size] for i in range(0, chunks, chunk_size)]
+        for c in chunk_list:
+            await i.send("```" + c + "```", ephemeral=True)
 
     @slash_command(name="add_pronoun", description="Adds a pronoun to a user")
     async def add_pronoun(self, i: Interaction, user: Member, emoji: str):
         try:
-            await sync_to_async(utils.discord_add_pronoun)(emoji, user.id)
-            new_name = await sync_to_async(utils.compute_discord_name)(user.id)
+            await self.bot.db(utils.discord_add_pronoun, emoji, user.id)
+            new_name = await self.bot.db(utils.compute_discord_name, user.id)
             await user.edit(nick=new_name)
         except Exception as e:
             self.bot.log("Failed to add pronoun to user " + user.name, level="ERROR")
@@ -212,8 +338,8 @@ class Management(commands.Cog):
     @slash_command(name="remove_pronoun", description="Removes a pronoun from a user")
     async def remove_pronoun(self, i: Interaction, user: Member, emoji: str):
         try:
-            await sync_to_async(utils.discord_remove_pronoun)(emoji, user.id)
-            new_name = await sync_to_async(utils.compute_discord_name)(user.id)
+            await self.bot.db(utils.discord_remove_pronoun, emoji, user.id)
+            new_name = await self.bot.db(utils.compute_discord_name, user.id)
             await user.edit(nick=new_name)
         except Exception as e:
             self.bot.log("Failed to remove pronoun from user " + user.name, level="ERROR")
@@ -236,7 +362,8 @@ class Management(commands.Cog):
     @slash_command(name="add_perm", description="Adds a permission to a user")
     @is_admin()
     async def add_perm(self, i: Interaction, user: Member, perm: str):
-        status = await sync_to_async(self.add_perm_sync)(user.id, perm)
+        status = await self.bot.db(self.add_perm_sync, user.id, perm)
+        permission_cache.invalidate(user.id)
         if status:
             await i.send("Added permission", ephemeral=True)
         else:
@@ -255,7 +382,9 @@ class Management(commands.Cog):
     @slash_command(name="add_group_perm", description="Adds a permission to a group")
     @is_admin()
     async def add_group_perm(self, i: Interaction, group: str, perm: str):
-        status = await sync_to_async(self.add_perm_group_sync)(group, perm)
+        status = await self.bot.db(self.add_perm_group_sync, group, perm)
+        # Any cached user could be in the group
+        permission_cache.clear()
         if status:
             await i.send("Added permission", ephemeral=True)
         else:
@@ -279,7 +408,9 @@ class Management(commands.Cog):
         ids = []
         for member in users.members:
             ids += [member.id]
-        status = await sync_to_async(self.add_group_sync)(ids, group)
+        status = await self.bot.db(self.add_group_sync, ids, group)
+        for id in ids:
+            permission_cache.invalidate(id)
         if status:
             await i.send("Added group", ephemeral=True)
         else:
@@ -288,7 +419,7 @@ class Management(commands.Cog):
     @slash_command(name="change_nick", description="Changed a user's nickname. Warning: Disables pronouns")
     @is_admin()
     async def change_nick(self, i: Interaction, user: Member, name: str):
-        result = await sync_to_async(utils.discord_override_name)(user.id, name)
+        result = await self.bot.db(utils.discord_override_name, user.id, name)
         if not result:
             await i.send("Failed to change name!", ephemeral=True)
             return
@@ -298,11 +429,11 @@ class Management(commands.Cog):
     @slash_command(name="clear_nick", description="Resets a user's nickname to the BOT's default")
     @is_admin()
     async def clear_nick(self, i: Interaction, user: Member):
-        result = await sync_to_async(utils.discord_clear_name)(user.id)
+        result = await self.bot.db(utils.discord_clear_name, user.id)
         if not result:
             await i.send("Failed to clear name!", ephemeral=True)
             return
-        new_name = await sync_to_async(utils.compute_discord_name)(user.id)
+        new_name = await self.bot.db(utils.compute_discord_name, user.id)
         await user.edit(nick=new_name)
 
         await i.send("Cleared nickname!", ephemeral=True)
@@ -310,14 +441,14 @@ class Management(commands.Cog):
     @slash_command(name="clear_nicks", description="Clears all nicknames")
     async def clear_nicks(self, i: Interaction):
         await i.response.defer(ephemeral=True)
-        async for user in i.guild.fetch_members():
-            try:
-                await sync_to_async(utils.discord_clear_name)(user.id)
-                new_name = await sync_to_async(utils.compute_discord_name)(user.id)
-                await user.edit(nick=new_name)
-            except Exception:
-                pass
-        await i.send("Cleared nicknames!", ephemeral=True)
+        ids = [m.id for m in i.guild.members]
+        await self.bot.db(utils.discord_clear_names, ids)
+        names = await self.bot.db(utils.compute_discord_names, ids)
+        targets = [(m.id, m) for m in i.guild.members if utils.nick_changed(m, names.get(m.id))]
+
+        async def action(m: Member):
+            await m.edit(nick=names.get(m.id))
+        self.bot.start_job(BulkJob("clear nicks", targets, action, concurrency=self.bulk_concurrency), i)
 
     @slash_command(name="echo", description="Echos messages back from the bot")
     @is_admin()
@@ -366,11 +497,10 @@ class Management(commands.Cog):
     async def untracked_channels(self, i: Interaction):
         await i.response.defer(ephemeral=True)
 
-        discord_channel_ids = set()
-        for channel in i.guild.text_channels + i.guild.voice_channels:
-            discord_channel_ids.add(channel.id)
+        discord_channel_ids = {c.id for c in self.bot.guild_index.channels(i.guild)
+                               if isinstance(c, (TextChannel, VoiceChannel))}
 
-        tracked_channel_ids = await sync_to_async(self.get_tracked_channel_ids)()
+        tracked_channel_ids = await self.bot.db(self.get_tracked_channel_ids)
 
         untracked_ids = discord_channel_ids - tracked_channel_ids
 
@@ -398,11 +528,9 @@ class Management(commands.Cog):
     async def clean_deleted_channels(self, i: Interaction, confirm: bool = False):
         await i.response.defer(ephemeral=True)
 
-        discord_channel_ids = set()
-        for channel in i.guild.text_channels + i.guild.voice_channels + i.guild.categories:
-            discord_channel_ids.add(channel.id)
+        discord_channel_ids = {c.id for c in self.bot.guild_index.channels(i.guild)}
 
-        tracked_channel_ids = await sync_to_async(self.get_tracked_channel_ids)()
+        tracked_channel_ids = await self.bot.db(self.get_tracked_channel_ids)
 
         deleted_ids = tracked_channel_ids - discord_channel_ids
 
@@ -410,47 +538,43 @@ class Management(commands.Cog):
             await i.send("No deleted channels found in common model!", ephemeral=True)
             return
 
-        deleted_channels = await sync_to_async(self.get_deleted_channel_details)(deleted_ids)
+        deleted_channels = await self.bot.db(self.get_deleted_channel_details, deleted_ids)
 
         channel_list = "\n".join([f"- {ch['name']} (ID: {ch['id']})" for ch in deleted_channels])
 
         if not confirm:
-            await i.send(f"**Found {len(deleted_channels)} deleted channels in common model:**\n{channel_list}\n\n"
-                         f"Run with `confirm: true` to delete.", ephemeral=True)
+            await self.send_chunked(i, f"**Found {len(deleted_channels)} deleted channels in common model:**\n"
+                                       f"{channel_list}\n\nRun with `confirm: true` to delete.")
             return
 
-        deleted_count = await sync_to_async(self.clean_deleted_channels_sync)(deleted_ids)
+        deleted_count = await self.bot.db(self.clean_deleted_channels_sync, deleted_ids)
         await i.send(f"Successfully cleaned {deleted_count} deleted channels from common model!", ephemeral=True)
 
     def get_deleted_channel_details(self, channel_ids):
-        deleted = []
-        for channel_id in channel_ids:
-            try:
-                channel = DiscordChannel.objects.get(id=channel_id)
-                deleted.append({"id": channel.id, "name": channel.name})
-            except DiscordChannel.DoesNotExist:
-                pass
-        return deleted
+        return list(DiscordChannel.objects.filter(id__in=list(channel_ids)).values("id", "name"))
 
     def clean_deleted_channels_sync(self, channel_ids):
-        count = 0
-        for channel_id in channel_ids:
-            try:
-                channel = DiscordChannel.objects.get(id=channel_id)
-                channel_name = channel.name
-                channel.delete()
-                count += 1
-                logger.info(f"Cleaned deleted channel from common model: {channel_name} (ID: {channel_id})")
-            except DiscordChannel.DoesNotExist:
-                logger.warning(f"Channel not found in common model: {channel_id}")
-            except Exception as e:
-                logger.error(f"Failed to delete channel {channel_id}: {e}")
+        channel_ids = set(channel_ids)
+        channels = DiscordChannel.objects.filter(id__in=list(channel_ids))
+        names = dict(channels.values_list("id", "name"))
+        for channel_id in channel_ids - names.keys():
+            logger.warning(f"Channel not found in common model: {channel_id}")
+        if not names:
+            return 0
+        deleted = channels.delete()[1].get(DiscordChannel._meta.label, 0)
+        logger.info("Cleaned deleted channels from common model: " +
+                    ", ".join(f"{name} (ID: {id})" for id, name in names.items()))
+        return deleted
 
-        return count
+    async def send_chunked(self, i: Interaction, response: str):
+        chunks, chunk_size = len(response), 1950
+        for c in [response[j:j+chunk_size] for j in range(0, chunks, chunk_size)]:
+            await i.send(c, ephemeral=True)
 
     @slash_command(name="bulk_delete_channels", description="Deletes channels from the server")
     @is_admin()
-    async def bulk_delete_channels(self, i: Interaction, channel_ids: str, confirm: bool = False):
+    async def bulk_delete_channels(self, i: Interaction, channel_ids: str, confirm: bool = False,
+                                   remove_from_db: bool = False):
         await i.response.defer(ephemeral=True)
 
         try:
@@ -483,48 +607,41 @@ class Management(commands.Cog):
             response = f"**About to delete {len(channels_to_delete)} channels:**\n{channel_list}"
             if not_found:
                 response += f"\n\n**Not found:** {', '.join(str(id) for id in not_found)}"
+            if remove_from_db:
+                response += "\n\nThey will also be removed from the common model."
             response += "\n\nRun with `confirm: true` to proceed."
-            await i.send(response, ephemeral=True)
+            await self.send_chunked(i, response)
             return
 
-        deleted_count = 0
-        errors = []
-
-        for channel in channels_to_delete:
-            try:
-                channel_name = channel.name
-                await channel.delete(reason="Deleted via bot bulk delete command")
-                deleted_count += 1
-                logger.info(f"Deleted channel: {channel_name} (ID: {channel.id})")
-            except Exception as e:
-                errors.append(f"{channel.name}: {e}")
-                logger.error(f"Failed to delete channel {channel.name}: {e}")
-
-        response = f"Successfully deleted {deleted_count}/{len(channels_to_delete)} channels.\n"
-        if errors:
-            response += f"Errors: {len(errors)}\n"
-            for error in errors:
-                response += f"- {error}\n"
+        # Every channel is its own route bucket, so pace the deletes to stay under the guild wide limit
+        limiter = TokenBucket(self.config.get("channel_delete_rate", 5))
+
+        async def action(channel):
+            await limiter.acquire()
+            await channel.delete(reason="Deleted via bot bulk delete command")
+            logger.info(f"Deleted channel: {channel.name} (ID: {channel.id})")
+
+        job = BulkJob("delete channels", [(ch.id, ch) for ch in channels_to_delete], action,
+                      concurrency=self.bulk_concurrency)
+        await self.bot.start_job(job, i).task
+
+        response = f"Successfully deleted {len(job.done)}/{job.total} channels.\n"
+        if remove_from_db and job.done:
+            cleaned = await self.bot.db(self.clean_deleted_channels_sync, job.done)
+            response += f"Removed {cleaned} of them from the common model.\n"
+        if job.failed:
+            response += f"Errors: {len(job.failed)}\n"
+            for channel_id, error in job.failed.items():
+                response += f"- {job.targets[channel_id].name}: {error}\n"
         if not_found:
             response += f"Not found: {', '.join(str(id) for id in not_found)}"
 
-        await i.send(response, ephemeral=True)
+        await self.send_chunked(i, response)
 
     @slash_command(name="overwrites", description="Lists the overwrites on a channel")
     @is_admin()
     async def overwrites(self, i: Interaction, id):
-        channels = i.guild.text_channels
-        channel = None
-        for c in channels:
-            if c.id == int(id):
-                channel = c
-                break
-        if channel is None:
-            channels = i.guild.voice_channels
-            for c in channels:
-                if c.id == int(id):
-                    channel = c
-                    break
+        channel = self.bot.guild_index.channel(i.guild, int(id))
         if channel is None:
             await i.send("Cannot find channel!", ephemeral=True)
             return
@@ -541,18 +658,7 @@ class Management(commands.Cog):
     @slash_command(name="add_overwrite", description="Adds an overwrite for a channel")
     @is_admin()
     async def add_overwrite(self, i: Interaction, id, role: Role, name, value):
-        channels = i.guild.text_channels
-        channel = None
-        for c in channels:
-            if c.id == int(id):
-                channel = c
-                break
-        if channel is None:
-            channels = i.guild.voice_channels
-            for c in channels:
-                if c.id == int(id):
-                    channel = c
-                    break
+        channel = self.bot.guild_index.channel(i.guild, int(id))
         if channel is None:
             await i.send("Cannot find channel!", ephemeral=True)
             return
@@ -563,18 +669,7 @@ class Management(commands.Cog):
     @slash_command(name="rename", description="Renames a channel")
     @is_admin()
     async def rename(self, i: Interaction, id, name):
-        channels = i.guild.text_channels
-        channel = None
-        for c in channels:
-            if c.id == int(id):
-                channel = c
-                break
-        if channel is None:
-            channels = i.guild.voice_channels
-            for c in channels:
-                if c.id == int(id):
-                    channel = c
-                    break
+        channel = self.bot.guild_index.channel(i.guild, int(id))
         if channel is None:
             await i.send("Cannot find channel!", ephemeral=True)
             return
@@ -585,40 +680,54 @@ class Management(commands.Cog):
     @slash_command(name="deleteoverwrite", description="Deletes an overwrite for a channel")
     @is_admin()
     async def delete_overwrite(self, i: Interaction, id, role: Role):
-        channels = i.guild.text_channels
-        channel = None
-        for c in channels:
-            if c.id == int(id):
-                channel = c
-                break
-        if channel is None:
-            channels = i.guild.voice_channels
-            for c in channels:
-                if c.id == int(id):
-                    channel = c
-                    break
+        channel = self.bot.guild_index.channel(i.guild, int(id))
         if channel is None:
             await i.send("Cannot find channel!", ephemeral=True)
             return
         await channel.set_permissions(role, overwrite=None)
         await i.send("Successfully changed overwrites!", ephemeral=True)
 
+    @commands.Cog.listener()
+    async def on_invite_create(self, invite):
+        self.invite_uses[invite.id] = invite.uses or 0
+
+    @commands.Cog.listener()
+    async def on_invite_delete(self, invite):
+        self.invite_uses.pop(invite.id, None)
+
+    async def get_used_invites(self, guild):
+        """Get the invites whose uses went up since the last snapshot."""
+        async with self.invite_lock:
+            invites = await guild.invites()
+            used = [i for i in invites if (i.uses or 0) > self.invite_uses.get(i.id, 0)]
+            self.invite_uses = {i.id: i.uses or 0 for i in invites}
+        return used
+
+    async def get_role_invite(self, link: str) -> Optional[RoleInvite]:
+        role_invite = self.role_invites.get(link)
+        if role_invite is None:
+            # Role invites can also be made through the website
+            role_invite = await self.bot.db(utils.get_role_invite, link)
+            if role_invite is not None:
+                self.role_invites[link] = role_invite
+        return role_invite
+
     @commands.Cog.listener()
     async def on_member_join(self, member):
         guild = member.guild
-        invites = await guild.invites()
-        role_invites = RoleInvite.objects.all()
-        for i in invites:
-            role_invite = await sync_to_async(role_invites.filter(link=i.id).first)()
+        for i in await self.get_used_invites(guild):
+            role_invite = await self.get_role_invite(i.id)
             if i.uses == 1 and role_invite is not None:
                 await i.delete()
                 for role in role_invite.role.split(","):
                     await member.add_roles(guild.get_role(int(role.strip())))
-                await sync_to_async(utils.link_userdetails)(role_invite,
-                                                            member.id, member.name, member.discriminator)
-                name = await sync_to_async(utils.compute_discord_name)(member.id)
+                await self.bot.db(utils.link_userdetails, role_invite,
+                                  member.id, member.name, member.discriminator)
+                permission_cache.invalidate(member.id)
+                name = await self.bot.db(utils.compute_discord_name, member.id)
                 await member.edit(nick=name)
-                await sync_to_async(role_invite.delete)()
+                await self.bot.db(role_invite.delete)
+                self.role_invites.pop(i.id, None)
                 break
 
     @slash_command(name="create_invite", description="Creates an invite that automatically grants a role.")
@@ -633,9 +742,10 @@ class Management(commands.Cog):
         role_invite.link = invite.id
         role_invite.role = str(role.id)
         role_invite.nick = ""
-        role_invite.user = await sync_to_async(utils.create_user)(name)
+        role_invite.user = await self.bot.db(utils.create_user, name)
 
-        await sync_to_async(role_invite.save)()
+        await self.bot.db(role_invite.save)
+        self.role_invites[role_invite.link] = role_invite
         await i.send(invite.url, ephemeral=True)
 
     @commands.Cog.listener()
@@ -649,7 +759,9 @@ class Management(commands.Cog):
 
         if user_id == self.bot.user.id:
             return
-        role_id = await sync_to_async(utils.role_react)(message_id, emoji.name)
+        if self.reaction_roles is None:
+            await self.load_reaction_tables()
+        role_id = self.reaction_roles.get((message_id, emoji.name))
         if role_id is not None:
             guild = self.bot.get_guild(payload.guild_id)
             user = guild.get_member(payload.user_id)
@@ -657,21 +769,19 @@ class Management(commands.Cog):
             await user.add_roles(role)
             self.bot.info("Added user " + str(payload.user_id) + " to role " + str(role_id), send_to_discord=False)
             return
-        for message in await sync_to_async(utils.get_messages)("pronoun"):
-            if message_id == message.id:
-                try:
-                    await sync_to_async(utils.discord_add_pronoun)(emoji.name, user_id)
-                    new_name = await sync_to_async(utils.compute_discord_name)(user_id)
-                    if len(new_name) > 32:
-                        self.bot.info("Did not add pronoun to user (name too long)" +
-                                      member.name + " -> " + new_name, send_to_discord=False)
-                    else:
-                        await member.edit(nick=new_name)
-                        self.bot.info("Added pronoun to user " + member.name + " -> " + new_name, send_to_discord=False)
-                    break
-                except Exception as e:
-                    self.bot.log("Failed to add pronoun to user " + member.name, level="ERROR",)
-                    self.bot.log(e, level="ERROR")
+        if message_id in self.pronoun_messages:
+            try:
+                await self.bot.db(utils.discord_add_pronoun, emoji.name, user_id)
+                new_name = await self.bot.db(utils.compute_discord_name, user_id)
+                if len(new_name) > 32:
+                    self.bot.info("Did not add pronoun to user (name too long)" +
+                                  member.name + " -> " + new_name, send_to_discord=False)
+                else:
+                    await member.edit(nick=new_name)
+                    self.bot.info("Added pronoun to user " + member.name + " -> " + new_name, send_to_discord=False)
+            except Exception as e:
+                self.bot.log("Failed to add pronoun to user " + member.name, level="ERROR",)
+                self.bot.log(e, level="ERROR")
 
     @commands.Cog.listener()
     async def on_raw_reaction_remove(self, payload):
@@ -685,7 +795,9 @@ class Management(commands.Cog):
 
         if user_id == self.bot.user.id:
             return
-        role_id = await sync_to_async(utils.role_react)(message_id, emoji.name)
+        if self.reaction_roles is None:
+            await self.load_reaction_tables()
+        role_id = self.reaction_roles.get((message_id, emoji.name))
         if role_id is not None:
             guild = self.bot.get_guild(payload.guild_id)
             user = guild.get_member(payload.user_id)
@@ -693,22 +805,20 @@ class Management(commands.Cog):
             await user.remove_roles(role)
             self.bot.info("Removed user " + str(payload.user_id) + " from role " + str(role_id), send_to_discord=False)
             return
-        for message in await sync_to_async(utils.get_messages)("pronoun"):
-            if message_id == message.id:
-                try:
-                    await sync_to_async(utils.discord_remove_pronoun)(emoji.name, user_id)
-                    new_name = await sync_to_async(utils.compute_discord_name)(user_id)
-                    await member.edit(nick=new_name)
-                    self.bot.info("Removed pronoun from user " + member.name + " -> " + new_name, send_to_discord=False)
-                    break
-                except Exception as e:
-                    self.bot.log("Failed to remove pronoun from user " + member.name, level="ERROR")
-                    self.bot.log(e, level="ERROR")
+        if message_id in self.pronoun_messages:
+            try:
+                await self.bot.db(utils.discord_remove_pronoun, emoji.name, user_id)
+                new_name = await self.bot.db(utils.compute_discord_name, user_id)
+                await member.edit(nick=new_name)
+                self.bot.info("Removed pronoun from user " + member.name + " -> " + new_name, send_to_discord=False)
+            except Exception as e:
+                self.bot.log("Failed to remove pronoun from user " + member.name, level="ERROR")
+                self.bot.log(e, level="ERROR")
 
     @slash_command(name="pronoun_create", description="Creates a pronoun option")
     @is_admin()
     async def pronoun_create(self, i: Interaction, name: str, emote: str):
-        await sync_to_async(utils.create_pronoun)(name, emote)
+        await self.bot.db(utils.create_pronoun, name, emote)
         await i.send("Successfully created pronoun", ephemeral=True)
 
     @slash_command(name="send_pronoun_message",
@@ -718,12 +828,13 @@ class Management(commands.Cog):
         """Send pronoun message in this channel."""
 
         await i.response.defer(with_message=True, ephemeral=True)
-        text = await sync_to_async(utils.create_discord_pronoun_message)()
+        text = await self.bot.db(utils.create_discord_pronoun_message)
         message = await i.channel.send(text)
 
-        for emote in await sync_to_async(utils.get_pronoun_emotes)():
+        for emote in await self.bot.db(utils.get_pronoun_emotes):
             await message.add_reaction(emote)
-        await sync_to_async(utils.register_message)("pronoun", message.id)
+        await self.bot.db(utils.register_message, "pronoun", message.id)
+        self.pronoun_messages.add(message.id)
 
         await i.send("Successfully created message!", ephemeral=True)
         return
@@ -731,8 +842,9 @@ class Management(commands.Cog):
     @slash_command(name="create_user", description="Creates a user")
     @is_admin()
     async def create_user(self, i: Interaction, user: Member, first_name: str, last_name: str):
-        await sync_to_async(utils.create_discord_user)(first_name, last_name, user.id,
-                                                       user.name, user.discriminator)
+        await self.bot.db(utils.create_discord_user, first_name, last_name, user.id,
+                          user.name, user.discriminator)
+        permission_cache.invalidate(user.id)
         await i.send("Created user in DB!", ephemeral=True)
 
     @slash_command(name="shutdown",
@@ -749,22 +861,15 @@ class Management(commands.Cog):
         else:
             return
 
-    def get(self, data: list, name: str):
-        name = name.lower()
-        for d in data:
-            if d.name.lower() == name:
-                return d
-        return None
-
     @slash_command(name="create_role", description="Creates a roles and it's channels")
     @has_permission("common_models.create_role")
     async def create_role(self, i: Interaction, name: str):
         guild = i.guild
         name = name.title()
-        if self.get(guild.roles, name) is not None:
+        if self.bot.guild_index.role(guild, name) is not None:
             await i.send("This role already exists!", ephemeral=True)
             return
-        if self.get(guild.categories, name) is not None:
+        if self.bot.guild_index.category(guild, name) is not None:
             await i.send("This category already exists!", ephemeral=True)
             return
         perms = Permissions(read_messages=True, send_messages=True)
@@ -779,7 +884,7 @@ class Management(commands.Cog):
     @slash_command(name="create_backend_group", description="Creates a group in the backend Django system")
     @is_admin()
     async def create_backend_group(self, i: Interaction, name: str):
-        await sync_to_async(Group.objects.create)(name=name)
+        await self.bot.db(Group.objects.create, name=name)
         await i.send("Created backend group!", ephemeral=True)
 
     @slash_command(name="create_group", description="Creates a channel with several roles allowed in it")
@@ -792,20 +897,20 @@ class Management(commands.Cog):
             return
         role1 = roles[0].title()
 
-        category = self.get(guild.categories, role1)
+        category = self.bot.guild_index.category(guild, role1)
         if category is None:
             await i.send("Unable to find a category with that name!", ephemeral=True)
             return
         r = []
         for j in range(len(roles)):
-            r += [self.get(guild.roles, roles[j].title())]
+            r += [self.bot.guild_index.role(guild, roles[j].title())]
             if r[j] is None:
                 await i.send("Unable to find a role with the name \""+roles[j]+"\"!", ephemeral=True)
                 return
         name = roles[0].lower()
         for j in range(1, len(roles)):
             name += "-" + roles[j].lower()
-        if self.get(category.text_channels, name) is not None:
+        if self.bot.guild_index.text_channel(guild, category, name) is not None:
             await i.send("This channel already exists!", ephemeral=True)
             return
         overwrites = {guild.default_role: PermissionOverwrite(view_channel=False)}
@@ -820,14 +925,12 @@ class Management(commands.Cog):
     @is_admin()
     async def rename_all(self, i: Interaction):
         await i.response.defer(with_message=True, ephemeral=True)
-        for m in i.guild.members:
-            name = await sync_to_async(utils.compute_discord_name)(m.id)
-            if m.display_name != name:
-                try:
-                    await m.edit(nick=name)
-                except Exception as e:
-                    logger.error(e)
-        await i.send("Reset all users nicks", ephemeral=True)
+        names = await self.bot.db(utils.compute_discord_names, [m.id for m in i.guild.members])
+        targets = [(m.id, m) for m in i.guild.members if utils.nick_changed(m, names.get(m.id))]
+
+        async def action(m: Member):
+            await m.edit(nick=names.get(m.id))
+        self.bot.start_job(BulkJob("rename all", targets, action, concurrency=self.bulk_concurrency), i)
 
     @slash_command(name="create_channel",
                    description="Creates a channel with two roles allowed in it but only named with the first group")
@@ -839,17 +942,17 @@ class Management(commands.Cog):
             await i.send("You must specify at least 1 role!", ephemeral=True)
             return
 
-        category = self.get(guild.categories, category)
+        category = self.bot.guild_index.category(guild, category)
         if category is None:
             await i.send("Unable to find a category with that name!", ephemeral=True)
             return
         r = []
         for j in range(len(roles)):
-            r += [self.get(guild.roles, roles[j].title())]
+            r += [self.bot.guild_index.role(guild, roles[j].title())]
             if r[j] is None:
                 await i.send("Unable to find a role with the name \""+roles[j]+"\"!", ephemeral=True)
                 return
-        if self.get(category.text_channels, name) is not None:
+        if self.bot.guild_index.text_channel(guild, category, name) is not None:
             await i.send("This channel already exists!", ephemeral=True)
             return
         overwrites = {guild.default_role: PermissionOverwrite(view_channel=False)}
@@ -887,78 +990,59 @@ class Management(commands.Cog):
     DEFAULT_MAGIC_LINK_EMAIL_SUBJECT = "Welcome to EngFrosh Heads Discord!"
     SENDER_EMAIL = "noreply@engfrosh.com"
 
-    @slash_command(name="import_users")
+    @slash_command(name="import_users", description="Invites and emails every name,role,email row of a CSV file")
     @is_admin()
     async def import_users(self, i: Interaction, csv_file: Attachment):
         await i.response.defer(with_message=True, ephemeral=True)
+        channel = i.guild.system_channel
+        if channel is None:
+            await i.send("Error: System channel is not configured!", ephemeral=True)
+            return
         data = await csv_file.read()
-        data = data.decode("UTF-8").split('\n')
-        AWS_REGION = "us-east-2"
-
-        # The character encoding for the email.
-        CHARSET = "UTF-8"
-
-        # Create a new SES resource and specify a region.
-        client = boto3.client('ses', region_name=AWS_REGION)
-        rows = []
+        rows, errors = importer.parse_rows(data, lambda name: self.bot.guild_index.role(i.guild, name.title()))
+        if errors:
+            response = f"Error: {len(errors)} invalid rows, nothing was imported!\n" + "\n".join(errors[:20])
+            await i.send(response[:2000], ephemeral=True)
+            return
 
-        for row in data:
-            if row == "":
-                continue
-            split = row.split(',')
-            name = split[0]
-            role = split[1]
-            email = split[2]
-            role = self.get(i.guild.roles, role.title())
-            if role is None:
-                await i.send("Error: Invalid role!", ephemeral=True)
-                return
-            channel = i.guild.system_channel
-            if channel is None:
-                await i.send("Error: System channel is not configured!", ephemeral=True)
-                return
-            split[1] = role
-            rows += [split]
-        for row in rows:
-            name = row[0]
-            role = row[1]
-            email = row[2]
-            invite = await channel.create_invite(max_uses=2)
-            role_invite = RoleInvite()
-            role_invite.link = invite.id
-            role_invite.role = str(role.id)
-            role_invite.nick = name
-            await sync_to_async(role_invite.save)()
-            url = invite.url
-            try:
-                client.send_email(
-                    Destination={
-                        'ToAddresses': [
-                            email,
-                        ],
-                    },
-                    Message={
-                        'Body': {
-                            'Html': {
-                                'Charset': CHARSET,
-                                'Data': self.DEFAULT_MAGIC_LINK_EMAIL_HTML.format(link=url),
-                            },
-                            'Text': {
-                                'Charset': CHARSET,
-                                'Data': self.DEFAULT_MAGIC_LINK_EMAIL_TEXT.format(link=url),
-                            },
-                        },
-                        'Subject': {
-                            'Charset': CHARSET,
-                            'Data': self.DEFAULT_MAGIC_LINK_EMAIL_SUBJECT,
-                        },
-                    },
-                    Source=self.SENDER_EMAIL
-                )
-                time.sleep(0.1)
-            except ClientError as e:
-                await i.send(e.response['Error']['Message'], ephemeral=True)
-        await i.send("Sent emails!", ephemeral=True)
+        mailer = self.import_mailer()
+        # Progress of each row by line, kept between runs so a resumed job redoes only the steps that failed
+        invites: Dict[int, Invite] = {}
+        saved: Set[int] = set()
+
+        async def import_row(row: importer.ImportRow):
+            if row.line not in invites:
+                invites[row.line] = await channel.create_invite(max_uses=2)
+            invite = invites[row.line]
+            if row.line not in saved:
+                role_invite = RoleInvite(link=invite.id, role=str(row.role.id), nick=row.name)
+                await self.bot.db(role_invite.save)
+                self.role_invites[role_invite.link] = role_invite
+                saved.add(row.line)
+            await mailer.send(row.email, invite.url)
+
+        job = BulkJob("import users", ((row.line, row) for row in rows), import_row,
+                      concurrency=self.bulk_concurrency)
+        await self.bot.start_job(job, i).task
+        if job.failed:
+            response = f"{len(job.failed)} rows were not fully imported, rerun them with /job_resume {job.id}\n"
+            response += "\n".join(f"Line {line}: {error}" for line, error in sorted(job.failed.items()))
+            await i.send(response[:2000], ephemeral=True)
+
+    def import_mailer(self) -> importer.Mailer:
+        """The mailer shared by every import, its thread pool is shut down when the bot closes."""
+        if self.mailer is None:
+            mail_config = self.config.get("import_email", {})
+            self.mailer = importer.Mailer(self.SENDER_EMAIL, self.DEFAULT_MAGIC_LINK_EMAIL_SUBJECT,
+                                          self.DEFAULT_MAGIC_LINK_EMAIL_TEXT, self.DEFAULT_MAGIC_LINK_EMAIL_HTML,
+                                          region=mail_config.get("region", "us-east-2"),
+                                          rate=mail_config.get("rate", 10), workers=mail_config.get("workers", 4))
+            mailer = self.mailer
+
+            async def close():
+                mailer.close()
+            self.bot.on_close("import_mailer", close)
+        return self.mailer
 
 
 def setup(bot):
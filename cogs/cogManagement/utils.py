@@ -2,6 +2,7 @@ import common_models.models as md
 from django.contrib.auth.models import User
 from common_models.models import RoleInvite
 import random
+import re
 import string
 
 
@@ -20,6 +21,11 @@ def role_react(message: int, emote: str):
     return None
 
 
+def get_reaction_roles() -> dict[tuple[int, str], int]:
+    # Keyed in Python because the database will screw up the emoji comparison
+    return {(r.message, r.emote): r.role for r in md.RoleOption.objects.all()}
+
+
 def add_pronoun(name: str, order: int, user: User):
     name = name.title()
     pronoun = md.Pronoun(name=name, order=order, user=user)
@@ -42,6 +48,34 @@ def compute_discord_name(user_id: int):
     return disc_user.compute_name()
 
 
+def format_discord_name(details: md.UserDetails, pronouns: list[str]) -> str:
+    """The nickname DiscordUser.compute_name gives, from details and pronoun names that are already loaded."""
+    if details.override_nick is not None:
+        return details.override_nick
+    if not pronouns:
+        return details.name
+    return details.name + " (" + ", ".join(pronouns) + ")"
+
+
+def compute_discord_names(user_ids) -> dict[int, str]:
+    """Compute the nicknames for many discord users in three queries, ids without a user are left out."""
+    disc_users = dict(md.DiscordUser.objects.filter(id__in=list(user_ids)).values_list("id", "user_id"))
+    details = {d.user_id: d for d in md.UserDetails.objects.filter(user_id__in=disc_users.values())}
+    pronouns: dict[int, list[str]] = {}
+    for user_id, name in md.Pronoun.objects.filter(user_id__in=details.keys()).order_by("order") \
+            .values_list("user_id", "name"):
+        pronouns.setdefault(user_id, []).append(name)
+
+    names = {}
+    for id, user_id in disc_users.items():
+        if user_id in details:
+            names[id] = format_discord_name(details[user_id], pronouns.get(user_id, []))
+        else:
+            # No details to format, let the model decide
+            names[id] = md.DiscordUser.objects.get(id=id).compute_name()
+    return names
+
+
 def create_user(name):
     split = name.split(" ")
     if len(split) < 2:
@@ -70,6 +104,14 @@ def create_discord_user(first, last, id, username, discriminator):
     link_discord_user(user, id, username, discriminator)
 
 
+def get_role_invites() -> dict[str, RoleInvite]:
+    return {r.link: r for r in RoleInvite.objects.select_related("user__user")}
+
+
+def get_role_invite(link: str):
+    return RoleInvite.objects.select_related("user__user").filter(link=link).first()
+
+
 def link_userdetails(invite: RoleInvite, id: int, username: str, discriminator: int):
     return link_discord_user(invite.user.user, id, username, discriminator)
 
@@ -143,6 +185,10 @@ def get_messages(type: str):
     return list(md.DiscordMessage.objects.filter(type=type).all())
 
 
+def get_message_ids(type: str) -> set[int]:
+    return set(md.DiscordMessage.objects.filter(type=type).values_list("id", flat=True))
+
+
 def create_pronoun(name: str, emote: str):
     opt = md.PronounOption(name=name, emote=emote)
     opt.save()
@@ -162,3 +208,20 @@ def discord_override_name(user_id, nick):
 
 def discord_clear_name(user_id):
     return discord_override_name(user_id, None)
+
+
+def discord_clear_names(user_ids) -> int:
+    """Clear the nickname override of many discord users with a single update."""
+    users = md.DiscordUser.objects.filter(id__in=list(user_ids)).values("user")
+    return md.UserDetails.objects.filter(user__in=users).update(override_nick=None)
+
+
+def nick_changed(member, name) -> bool:
+    if name is None:
+        return member.nick is not None
+    return member.display_name != name
+
+
+def text_channel_name(name: str) -> str:
+    """The name discord gives a text channel created with this name."""
+    return re.sub(r"\s+", "-", name.strip().lower())
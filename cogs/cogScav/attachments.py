@@ -0,0 +1,118 @@
+"""Cache of puzzle attachments so /question doesn't read and upload the same file for every team."""
+
+from __future__ import annotations
+
+import asyncio
+import io
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Tuple
+
+logger = logging.getLogger("Cogs.Scav.Attachments")
+
+FileKey = Tuple[int, float]
+
+
+class MemoryViewReader(io.RawIOBase):
+    """Read only file object over a memoryview, so sends don't copy the cached bytes."""
+
+    def __init__(self, view: memoryview):
+        self._view = view
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._pos = max(0, min(offset, len(self._view)))
+        return self._pos
+
+    def readinto(self, b) -> int:
+        n = max(0, min(len(b), len(self._view) - self._pos))
+        b[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+
+def file_key(puzzle_id: int, path: str) -> FileKey:
+    """Key of the puzzle file's current contents, a replaced file gets a new mtime."""
+    return (puzzle_id, os.stat(path).st_mtime)
+
+
+class PuzzleFileCache:
+    """LRU cache of puzzle file contents keyed by puzzle id and mtime, bounded by the total size in bytes."""
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._files: OrderedDict[FileKey, bytes] = OrderedDict()
+
+    @staticmethod
+    def _read(path: str) -> bytes:
+        with open(path, "rb") as f:
+            return f.read()
+
+    async def key(self, puzzle_id: int, path: str) -> FileKey:
+        """Key of the puzzle file, stat'd on a worker thread since puzzle files may be on slow storage."""
+        return await asyncio.get_running_loop().run_in_executor(None, file_key, puzzle_id, path)
+
+    async def get(self, key: FileKey, path: str) -> memoryview:
+        data = self._files.get(key)
+        if data is not None:
+            self.hits += 1
+            self._files.move_to_end(key)
+            return memoryview(data)
+
+        self.misses += 1
+        data = await asyncio.get_running_loop().run_in_executor(None, self._read, path)
+        if len(data) <= self.max_bytes:
+            # Drop older versions of the same puzzle's file
+            for old in [k for k in self._files if k[0] == key[0]]:
+                self.size -= len(self._files.pop(old))
+            self._files[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                self.size -= len(self._files.popitem(last=False)[1])
+        return memoryview(data)
+
+    def stats(self) -> Dict[str, int]:
+        return {"files": len(self._files), "bytes": self.size, "hits": self.hits, "misses": self.misses}
+
+
+class StagedFiles:
+    """Uploads each puzzle file once to a staging channel and hands out its attachment URL.
+
+    Discord attachment URLs are signed and expire, so uploads are redone after url_ttl seconds.
+    """
+
+    def __init__(self, url_ttl: float = 12 * 60 * 60):
+        self.url_ttl = url_ttl
+        self._urls: Dict[FileKey, Tuple[str, float]] = {}
+        self._uploads: Dict[FileKey, asyncio.Task] = {}
+
+    async def url(self, key: FileKey, upload: Callable[[], Awaitable[str]]) -> str:
+        cached = self._urls.get(key)
+        if cached is not None and time.monotonic() - cached[1] < self.url_ttl:
+            return cached[0]
+        # Teams asking at the same time share the one upload
+        task = self._uploads.get(key)
+        if task is None:
+            task = self._uploads[key] = asyncio.create_task(upload())
+            task.add_done_callback(lambda t: self._uploads.pop(key, None))
+        url = await asyncio.shield(task)
+        self._urls[key] = (url, time.monotonic())
+        return url
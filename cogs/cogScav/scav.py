@@ -2,29 +2,51 @@
 import logging
 
 import nextcord
-from nextcord.ext import commands
+from nextcord.ext import commands, tasks
 from nextcord import slash_command, Interaction, Member, SlashOption, TextChannel, NotFound, Role
 from nextcord.ui import View, Button
-from typing import Optional
+from typing import Dict, Optional, Tuple
+from collections import OrderedDict
+from dataclasses import dataclass
+import datetime
 
 from common_models.models import BooleanSetting, VerificationPhoto, Team, UserDetails, DiscordUser, FroshRole
-from common_models.models import Puzzle, TeamPuzzleActivity, PuzzleGuess, DiscordRole
+from common_models.models import TeamPuzzleActivity, PuzzleGuess, DiscordRole
 
-from django.core.files import File
+from django.utils import timezone
 
 from EngFroshBot import EngFroshBot, has_permission
-from asgiref.sync import sync_to_async
-import requests
-from requests.auth import HTTPBasicAuth
-from urllib.parse import urlparse
+from leaderboard import Leaderboard
+from ratelimit import KeyedRateLimiter, try_acquire_all
+from cogs.cogScav.transfer import ScavTransferClient, PhotoUploadError
+from cogs.cogScav.attachments import MemoryViewReader, PuzzleFileCache, StagedFiles
+import asyncio
+import io
+import math
 import os
-import json
+import time
 import uuid
 # endregion
 
 
 logger = logging.getLogger("Cogs.Scav")
 
+# Frosh role names almost never change during an event, so they are kept in memory
+# and refreshed on an interval or by /refresh_frosh_roles instead of queried per command.
+frosh_role_names: Optional[frozenset] = None
+
+
+def load_frosh_role_names() -> frozenset:
+    global frosh_role_names
+    frosh_role_names = frozenset(FroshRole.objects.values_list("name", flat=True))
+    return frosh_role_names
+
+
+def get_frosh_role_names() -> frozenset:
+    if frosh_role_names is None:
+        return load_frosh_role_names()
+    return frosh_role_names
+
 
 class VerifyButton(Button):
     def __init__(self, label: str, callback, photo: VerificationPhoto, channel: TextChannel):
@@ -37,17 +59,123 @@ class VerifyButton(Button):
         await self.callback_fun(i, self.photo, self.channel)
 
 
+@dataclass(frozen=True)
+class CallerContext:
+    """Everything a scav command needs to know about the user calling it."""
+
+    scav_enabled: bool
+    user: Optional[UserDetails]
+    team: Optional[Team]
+    role: Optional[str]
+    team_enabled: bool
+    puzzles: tuple
+    activity: Optional[TeamPuzzleActivity]
+    answer: Optional[str] = None
+    finished: bool = False
+    lockout_until: Optional[datetime.datetime] = None
+
+
+@dataclass(frozen=True)
+class TeamScavState:
+    """A team's scav progress, which only changes on completion, lockout or photo verification.
+
+    Everything is loaded on the database thread, the team is only kept for its id and name so its properties
+    (which may query the database) are never evaluated on the event loop.
+    """
+
+    team: Team
+    group_id: int
+    puzzles: tuple
+    answer: Optional[str]
+    activity: Optional[TeamPuzzleActivity]
+    enabled: bool
+    finished: bool
+    lockout_until: Optional[datetime.datetime]
+    # Monotonic time after which the state has to be reloaded, at most the TTL and at the end of a lockout
+    expires_at: float
+
+    @property
+    def team_id(self) -> int:
+        return self.team.id
+
+    @property
+    def activity_id(self) -> Optional[int]:
+        return self.activity.id if self.activity is not None else None
+
+    def fresh(self) -> bool:
+        return time.monotonic() < self.expires_at
+
+
+def lockout_remaining(lockout_until: Optional[datetime.datetime]) -> str:
+    if lockout_until is None:
+        return "0:00:00"
+    remaining = max(lockout_until - timezone.now(), datetime.timedelta())
+    return str(remaining - datetime.timedelta(microseconds=remaining.microseconds))
+
+
 class Scav(commands.Cog):
     def __init__(self, bot: EngFroshBot):
         self.bot = bot
         self.server = bot.config["server"]
         self.config = bot.config["module_settings"]["scav"]
+        self.transfer = ScavTransferClient(self.server, timeout=self.config.get("upload_timeout", 30),
+                                           retries=self.config.get("upload_retries", 3))
+        # The session has to be closed before the event loop stops, not only when the cog is unloaded
+        bot.on_close("scav_transfer", self.transfer.close)
+        self.max_photo_size = self.config.get("max_photo_size", 8 * 1024 * 1024)
+        # Bounds how many photo buffers are held in memory at once
+        self.photo_slots = asyncio.Semaphore(self.config.get("max_concurrent_photos", 4))
+        self.puzzle_files = PuzzleFileCache(self.config.get("puzzle_file_cache_bytes", 64 * 1024 * 1024))
+        # Optional channel that each puzzle file is uploaded to once, teams then get its URL
+        self.staging_channel = self.config.get("puzzle_staging_channel")
+        self.staged_files = StagedFiles(self.config.get("puzzle_staging_url_ttl", 12 * 60 * 60))
+        self.leaderboard = Leaderboard()
+        # Team id -> cached scav state, and team group id -> team id for looking up callers
+        self.team_states: Dict[int, TeamScavState] = {}
+        # Team id -> generation of its state, bumped by every refresh so a state loaded before it isn't stored
+        self.team_state_generations: Dict[int, int] = {}
+        self.team_groups: Dict[int, int] = {}
+        self.team_state_ttl = self.config.get("team_state_ttl", 60)
+        # Each team guesses in its own channel, so team limits are keyed by channel
+        self.user_guess_limiter = KeyedRateLimiter(self.config.get("user_guess_rate", 0.5),
+                                                   self.config.get("user_guess_burst", 3))
+        self.team_guess_limiter = KeyedRateLimiter(self.config.get("team_guess_rate", 1),
+                                                   self.config.get("team_guess_burst", 5))
+        self.wrong_guess_ttl = self.config.get("wrong_guess_ttl", 120)
+        # (team id, puzzle id, lower cased guess) -> expiry of recent wrong guesses, oldest first
+        self.recent_wrong_guesses: OrderedDict[Tuple[int, int, str], float] = OrderedDict()
+        # User id -> (team id, expiry) of callers that last passed every scav check, and the cached
+        # SCAVENGER_ENABLED setting, so repeated wrong guesses can be answered without the database
+        self.allowed_callers: Dict[int, Tuple[int, float]] = {}
+        self.scav_enabled_cache: Tuple[bool, float] = (False, 0.0)
+        self.guesses = bot.write_buffer("puzzle_guess", PuzzleGuess, self.config.get("guess_flush_ms", 500) / 1000,
+                                        self.config.get("guess_batch_size", 100))
+        self.board = bot.scoreboard("scav", self.config.get("scoreboard_channels", []), self.render_scoreboard,
+                                    interval=self.config.get("scoreboard_interval", 5))
+        self.refresh_frosh_roles_loop.change_interval(minutes=self.config.get("frosh_role_refresh_minutes", 10))
+
+    def cog_unload(self):
+        self.refresh_frosh_roles_loop.cancel()
+        asyncio.create_task(self.guesses.flush())
+        asyncio.create_task(self.transfer.close())
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        if not self.refresh_frosh_roles_loop.is_running():
+            self.refresh_frosh_roles_loop.start()
+        if not self.leaderboard.seeded:
+            await self.seed_leaderboard()
+
+    @tasks.loop(minutes=10)
+    async def refresh_frosh_roles_loop(self):
+        names = await self.bot.db(load_frosh_role_names)
+        logger.debug(f"Refreshed frosh role names: {sorted(names)}")
 
     def check_scavenger_setting_enabled(self):
         return BooleanSetting.objects.filter(id="SCAVENGER_ENABLED").first()
 
     async def scav_enabled(self):
-        return await sync_to_async(self.check_scavenger_setting_enabled)()
+        return await self.bot.db(self.check_scavenger_setting_enabled)
 
     class ScavNotEnabledError(Exception):
         """Exception raised when scav is not enabled."""
@@ -61,118 +189,224 @@ class Scav(commands.Cog):
     def get_all_scav_teams(self):
         return list(Team.objects.filter(scavenger_enabled_for_team=True))
 
-    async def update_scoreboard(self):
-        """Update the scoreboard channel with the current standings."""
+    async def seed_leaderboard(self):
+        teams = await self.bot.db(self.get_all_scav_teams)
+        self.leaderboard.seed((team.id, team.display_name, team.current_question) for team in teams)
 
-        logger.debug("Updating Scav board...")
-        teams = await sync_to_async(self.get_all_scav_teams())()
-        teams.sort(key=lambda team: team.current_question, reverse=True)
+    def get_team_progress(self, team: Team):
+        team.refresh_from_db()
+        return team.current_question
 
-        msg = "```\n"
+    def get_activity_team(self, activity: TeamPuzzleActivity) -> Team:
+        return activity.team
 
-        cur_place = 0
-        cur_question = None
-        next_place = 1
+    def load_team_state(self, team_id: int) -> Optional[TeamScavState]:
+        """Load the team's scav state, only reads the database so it can run on the database thread."""
 
-        for team in teams:
-            if team.current_question == cur_question:
-                place = cur_place
-                next_place += 1
-            else:
-                place = next_place
-                cur_place = next_place
-                next_place += 1
-                cur_question = team.current_question
+        team = Team.objects.filter(id=team_id).first()
+        if team is None:
+            return None
+        puzzles = tuple(team.active_puzzles)
+        answer = None
+        activity = None
+        if len(puzzles) == 1:
+            answer = puzzles[0].answer.lower()
+            activity = TeamPuzzleActivity.objects.filter(team=team, puzzle=puzzles[0]).first()
+        enabled = team.scavenger_enabled
+        lockout_until = team.scavenger_locked_out_until
+        expires_at = time.monotonic() + self.team_state_ttl
+        if lockout_until is not None:
+            locked_for = (lockout_until - timezone.now()).total_seconds()
+            if locked_for > 0:
+                expires_at = min(expires_at, time.monotonic() + locked_for)
+        return TeamScavState(team, team.group_id, puzzles, answer, activity, enabled, team.scavenger_finished,
+                             lockout_until, expires_at)
+
+    def get_team_state(self, team_id: int) -> Tuple[Optional[TeamScavState], bool]:
+        """Cached scav state of the team, loaded if missing or expired. Also returns whether it was loaded."""
+
+        state = self.team_states.get(team_id)
+        if state is None or not state.fresh():
+            return (self.load_team_state(team_id), True)
+        return (state, False)
+
+    def store_team_state(self, team_id: int, state: Optional[TeamScavState], generation: Optional[int] = None) -> None:
+        """Store the team's state, unless it was loaded at an older generation than the current one."""
+
+        current = self.team_state_generations.get(team_id, 0)
+        if generation is None:
+            self.team_state_generations[team_id] = current + 1
+        elif generation != current:
+            return
+        if state is None:
+            self.team_states.pop(team_id, None)
+            return
+        self.team_states[team_id] = state
+        self.team_groups[state.group_id] = team_id
+
+    async def refresh_team_state(self, team_id: int) -> None:
+        generation = self.team_state_generations[team_id] = self.team_state_generations.get(team_id, 0) + 1
+        self.store_team_state(team_id, await self.bot.db(self.load_team_state, team_id), generation)
+
+    def remember_wrong_guess(self, team_id: int, puzzle_id: int, guess: str) -> None:
+        now = time.monotonic()
+        key = (team_id, puzzle_id, guess)
+        self.recent_wrong_guesses.pop(key, None)
+        self.recent_wrong_guesses[key] = now + self.wrong_guess_ttl
+        while next(iter(self.recent_wrong_guesses.values())) < now:
+            self.recent_wrong_guesses.popitem(last=False)
+
+    def is_repeat_wrong_guess(self, user_id: int, channel_id: int, guess: str) -> bool:
+        """Whether the caller's team already tried this wrong answer for its current puzzle.
+
+        Only answers for callers that recently passed every check of scav_user_allowed while scav is enabled,
+        and only from fresh team state, anything else goes through the full checks.
+        """
 
-            msg += f"{place}. {team.display_name}: {team.current_question}\n"
+        now = time.monotonic()
+        if channel_id not in self.config['team_channels']:
+            return False
+        enabled, enabled_expiry = self.scav_enabled_cache
+        if not enabled or enabled_expiry <= now:
+            return False
+        caller = self.allowed_callers.get(user_id)
+        if caller is None or caller[1] <= now:
+            return False
+        state = self.team_states.get(caller[0])
+        if state is None or not state.fresh() or not state.enabled or state.finished or len(state.puzzles) != 1:
+            return False
+        expiry = self.recent_wrong_guesses.get((state.team_id, state.puzzles[0].id, guess))
+        return expiry is not None and expiry > now
 
-        msg += "```"
+    async def team_progressed(self, team: Team):
+        """Update the team's place on the leaderboard and schedule a scoreboard update."""
 
-        channels = self.config["scoreboard_channels"]
+        await self.refresh_team_state(team.id)
+        current_question = await self.bot.db(self.get_team_progress, team)
+        if self.leaderboard.seeded:
+            self.leaderboard.update(team.id, team.display_name, current_question)
+        self.board.request_update()
 
-        await self.bot.send_to_all(msg, channels, purge_first=True)
+    async def render_scoreboard(self) -> str:
+        """Render the current scav standings."""
+
+        logger.debug("Rendering Scav board...")
+        if not self.leaderboard.seeded:
+            await self.seed_leaderboard()
+
+        msg = ""
+        for place, name, current_question in self.leaderboard.standings():
+            msg += f"{place}. {name}: {current_question}\n"
+
+        return msg
 
     def get_user_from_discord(self, author: Member):
-        user = DiscordUser.objects.filter(discord_username=author.name, discriminator=author.discriminator).first()
-        if user is None:
-            return None
-        return UserDetails.objects.filter(user=user.user).first()
-
-    def get_user_team(self, user: UserDetails):
-        frosh_groups = FroshRole.objects.all()
-        names = []
-        for g in frosh_groups:
-            names += [g.name]
-        team = user.user.groups.exclude(name__in=names).first()
-        if team is None:
-            return None
-        return Team.objects.filter(group=team).first()
-
-    def get_user_role(self, user: UserDetails):
-        frosh_groups = FroshRole.objects.all()
-        names = []
-        for g in frosh_groups:
-            names += [g.name]
-        role = user.user.groups.filter(name__in=names).first()
-        if role is None:
-            return None
-        return role.name
+        discord_users = DiscordUser.objects.filter(discord_username=author.name, discriminator=author.discriminator)
+        return UserDetails.objects.select_related("user").prefetch_related("user__groups") \
+            .filter(user__in=discord_users.values("user")).first()
 
-    def team_scav_enabled(self, team: Team) -> bool:
-        # This has to be here because team.scavenger_enabled has the property decorator
-        return team.scavenger_enabled
+    def get_caller_context(self, author: Member) -> Tuple[CallerContext, Optional[Tuple[TeamScavState, int]]]:
+        """Resolve the user, team, role and active puzzle of the caller in a single thread hop.
 
-    async def scav_user_allowed(self, i: Interaction) -> bool:
+        Runs on the database thread so it only reads the team state cache, a state it had to load is returned
+        with the team's generation from before the load, to be stored back on the event loop if still current.
+        """
+
+        scav_enabled = bool(self.check_scavenger_setting_enabled())
+        user = self.get_user_from_discord(author)
+        if user is None:
+            return (CallerContext(scav_enabled, None, None, None, False, (), None), None)
+
+        names = get_frosh_role_names()
+        # Groups are prefetched, sort by pk to match what .first() would return
+        groups = sorted(user.user.groups.all(), key=lambda g: g.pk)
+        role = next((g.name for g in groups if g.name in names), None)
+        team_group = next((g for g in groups if g.name not in names), None)
+        if team_group is None:
+            return (CallerContext(scav_enabled, user, None, role, False, (), None), None)
+        team_id = self.team_groups.get(team_group.pk)
+        if team_id is None:
+            team = Team.objects.filter(group=team_group).first()
+            if team is None:
+                return (CallerContext(scav_enabled, user, None, role, False, (), None), None)
+            team_id = team.id
+        generation = self.team_state_generations.get(team_id, 0)
+        state, loaded = self.get_team_state(team_id)
+        if state is None:
+            return (CallerContext(scav_enabled, user, None, role, False, (), None), None)
+
+        ctx = CallerContext(scav_enabled, user, state.team, role, state.enabled, state.puzzles, state.activity,
+                            state.answer, state.finished, state.lockout_until)
+        return (ctx, (state, generation) if loaded else None)
+
+    async def caller_context(self, author: Member) -> CallerContext:
+        ctx, loaded = await self.bot.db(self.get_caller_context, author)
+        self.scav_enabled_cache = (ctx.scav_enabled, time.monotonic() + self.team_state_ttl)
+        if loaded is not None:
+            state, generation = loaded
+            self.store_team_state(state.team_id, state, generation)
+        return ctx
+
+    async def scav_user_allowed(self, i: Interaction) -> Optional[CallerContext]:
         """
         Check if the user and channel are correct and allowed to guess / request a hint,
         and send messages stating errors if not.
 
+        Returns the caller context if allowed, otherwise None.
         """
 
+        self.allowed_callers.pop(i.user.id, None)
         if i.channel.id not in self.config['team_channels']:
             await i.send("There is no scav team associated with this channel.", ephemeral=True)
-            return False
+            return None
 
+        ctx = await self.caller_context(i.user)
         # Check that scav is enabled
-        enabled = await self.scav_enabled()
-        if not enabled:
+        if not ctx.scav_enabled:
             await i.send("Scav is not currently enabled.", ephemeral=True)
-            return False
-        user = await sync_to_async(self.get_user_from_discord)(i.user)
-        team = await sync_to_async(self.get_user_team)(user)
-        role = await sync_to_async(self.get_user_role)(user)
+            return None
+        team = ctx.team
         # Guess automatically goes towards their team
         if team is None:
             await i.send("You are not on a team!", ephemeral=True)
-            return False
-        if not await sync_to_async(self.team_scav_enabled)(team):
-            await i.send(f"Your team is currently locked out for: {team.lockout_remaining}", ephemeral=True)
-            return False
+            return None
+        if not ctx.team_enabled:
+            await i.send(f"Your team is currently locked out for: {lockout_remaining(ctx.lockout_until)}",
+                         ephemeral=True)
+            return None
 
-        if team.scavenger_finished:
+        if ctx.finished:
             await i.send("You're already finished Scav!", ephemeral=True)
-            return False
-        if role == "Frosh":
+            return None
+        if ctx.role == "Frosh":
             await i.send("Frosh cannot submit scav answers!", ephemeral=True)
-            return False
-        return True
+            return None
+        self.allowed_callers[i.user.id] = (team.id, time.monotonic() + self.team_state_ttl)
+        return ctx
 
-    def get_team_puzzle_activity(self, team: Team, puzzle: Puzzle):
-        return TeamPuzzleActivity.objects.filter(team=team, puzzle=puzzle).first()
+    async def read_verification_photo(self, file: nextcord.Attachment) -> Optional[bytes]:
+        """Read the attachment from discord once, returns None if it is too large or can't be read."""
+
+        if file.size > self.max_photo_size:
+            return None
+        try:
+            data = await file.read()
+        except nextcord.HTTPException as e:
+            logger.warning(f"Failed to read verification photo: {e}")
+            return None
+        if len(data) > self.max_photo_size:
+            return None
+        return data
 
-    def get_team_active_puzzles(self, team: Team):
-        return team.active_puzzles
+    async def scav_photo_upload(self, data: bytes, file: nextcord.Attachment) -> Optional[int]:
+        """Upload the photo bytes to the site, returning the photo id."""
 
-    def scav_photo_upload(self, file):
-        url = self.server + "api/photo"
-        files = {'photo': open(file, 'rb')}
-        user = os.environ['SERVER_USER']
-        passwd = os.environ['SERVER_PASS']
-        r = requests.post(url, files=files, auth=HTTPBasicAuth(user, passwd))
-        if r.status_code != 200:
+        ext = file.filename.split('.')[-1]
+        try:
+            return await self.transfer.upload_photo(data, str(uuid.uuid4()) + '.' + ext, file.content_type)
+        except PhotoUploadError as e:
+            logger.error(e)
             return None
-        data = json.loads(r.text)
-        return data['id']
 
     def get_photo(self, id):
         return VerificationPhoto.objects.filter(id=id)[0]
@@ -185,34 +419,45 @@ class Scav(commands.Cog):
     async def guess(self, i: Interaction, guess: str, file: Optional[nextcord.Attachment] = SlashOption(required=False)):  # noqa: E501
         """Make a guess of the answer to the current scav question."""
 
-        allowed = await self.scav_user_allowed(i)
-        if not allowed:
+        if not try_acquire_all(self.user_guess_limiter.bucket(i.user.id), self.team_guess_limiter.bucket(i.channel.id)):
+            wait = max(self.user_guess_limiter.retry_after(i.user.id),
+                       self.team_guess_limiter.retry_after(i.channel.id))
+            self.bot.metrics.inc("scav_guesses_total", result="rate_limited")
+            await i.send(f"You're guessing too fast, try again in {math.ceil(wait)} seconds.", ephemeral=True)
             return
+        if self.is_repeat_wrong_guess(i.user.id, i.channel.id, guess.lower()):
+            self.bot.metrics.inc("scav_guesses_total", result="repeat")
+            await i.send("Incorrect guess, your team already tried that answer.", ephemeral=True)
+            return
+        if file is not None:
+            # The checks, the guess and the photo upload can take longer than the interaction response window
+            await i.response.defer()
 
-        user = await sync_to_async(self.get_user_from_discord)(i.user)
-        team = await sync_to_async(self.get_user_team)(user)
-
-        if team.scavenger_finished:
-            i.send("Your team has already finished scav!", ephemeral=True)
+        ctx = await self.scav_user_allowed(i)
+        if ctx is None:
             return
+        team = ctx.team
 
-        puzzles = await sync_to_async(self.get_team_active_puzzles)(team)
-        if len(puzzles) != 1:
+        if len(ctx.puzzles) != 1:
             await i.send("Your team has no active puzzles or too many active puzzles!", ephemeral=True)
             return
-        puzzle = puzzles[0]
+        puzzle = ctx.puzzles[0]
         if not puzzle.enabled:
-            team.refresh_scavenger_progress()
+            await self.bot.db(team.refresh_scavenger_progress)
+            await self.refresh_team_state(team.id)
             await i.send("An error occurred, please resubmit." +
                          " If this continues please contact planning", ephemeral=True)
             return
-        activity = await sync_to_async(self.get_team_puzzle_activity)(team, puzzle)
+        activity = ctx.activity
         p_guess = PuzzleGuess()
         p_guess.value = guess
         p_guess.activity = activity
-        await sync_to_async(p_guess.save)()
 
-        if guess.lower() != puzzle.answer.lower():
+        if guess.lower() != ctx.answer:
+            # Wrong guesses are only kept for the record, so the reply doesn't wait on the insert
+            self.guesses.add(p_guess)
+            self.remember_wrong_guess(team.id, puzzle.id, guess.lower())
+            self.bot.metrics.inc("scav_guesses_total", result="incorrect")
             try:
                 if self.config["incorrect_message"]:
                     await i.send(self.config["incorrect_message"])
@@ -221,46 +466,49 @@ class Scav(commands.Cog):
             except NotFound:
                 pass
             return
+        self.bot.metrics.inc("scav_guesses_total", result="correct")
+        # Write correct guesses in order after the ones still buffered, before completing the puzzle
+        await self.guesses.flush()
+        await self.bot.db(p_guess.save)
         if puzzle.require_photo_upload and file is None:
             await i.send("Your guess is correct, but you must attach a verification photo to it when submitting it!")
             return
         elif not puzzle.require_photo_upload:
-            await sync_to_async(activity.mark_completed)()
+            await self.bot.db(activity.mark_completed)
+            await self.team_progressed(team)
             await i.send("Completed scav puzzle")
             return
-        url = file.url
-        name = urlparse(url).path.split('/')[-1]  # Taken from https://stackoverflow.com/a/42341786
-        headers = {
-            'User-Agent': self.config['user_agent'],  # Have to fake user agent to make requests to discord's cdn
-        }
-        response = requests.get(url, headers=headers)
-        if response.status_code != 200:
-            await i.send("Failed to open verification image, please resend!", ephemeral=True)
-            return
-
-        ext = name.split('.')[-1]
-        new_name = str(uuid.uuid4())+'.'+ext
-        with open("/tmp/" + new_name, "wb") as f:
-            f.write(response.content)
-            f.close()
-        photo_id = await sync_to_async(self.scav_photo_upload)("/tmp/" + new_name)
-        photo = await sync_to_async(self.get_photo)(photo_id)
-
-        await sync_to_async(self.set_photo)(activity, photo)
-        await sync_to_async(activity.save)()
-        await sync_to_async(activity.mark_completed)()
-
-        sendable_file = await file.to_file()
-
-        verify_channel = i.guild.get_channel(self.config['verify_channel'])
-        view = View()
-        deny = VerifyButton("Deny", self.scav_deny, photo, i.channel)
-        approve = VerifyButton("Approve", self.scav_approve, photo, i.channel)
-        view.add_item(deny)
-        view.add_item(approve)
-
-        await verify_channel.send(f"Team {team.display_name} submitted a photo for approval" +
-                                  f" for question {puzzle.name}", file=sendable_file, view=view)
+        async with self.photo_slots:
+            with self.bot.metrics.timer("phase_seconds", phase="photo_read"):
+                data = await self.read_verification_photo(file)
+            if data is None:
+                await i.send("Failed to open verification image, please resend! " +
+                             f"Photos must be under {self.max_photo_size // (1024 * 1024)}MB.", ephemeral=True)
+                return
+            with self.bot.metrics.timer("phase_seconds", phase="photo_upload"):
+                photo_id = await self.scav_photo_upload(data, file)
+            if photo_id is None:
+                await i.send("Failed to upload verification image, please resend!", ephemeral=True)
+                return
+            photo = await self.bot.db(self.get_photo, photo_id)
+
+            await self.bot.db(self.set_photo, activity, photo)
+            await self.bot.db(activity.save)
+            await self.bot.db(activity.mark_completed)
+            await self.team_progressed(team)
+
+            # Reuse the buffer that was uploaded instead of downloading the attachment again
+            sendable_file = nextcord.File(io.BytesIO(data), filename=file.filename)
+
+            verify_channel = i.guild.get_channel(self.config['verify_channel'])
+            view = View()
+            deny = VerifyButton("Deny", self.scav_deny, photo, i.channel)
+            approve = VerifyButton("Approve", self.scav_approve, photo, i.channel)
+            view.add_item(deny)
+            view.add_item(approve)
+
+            await verify_channel.send(f"Team {team.display_name} submitted a photo for approval" +
+                                      f" for question {puzzle.name}", file=sendable_file, view=view)
 
         await i.send("Completed scav puzzle, please wait for it to be verified!")
 
@@ -268,16 +516,23 @@ class Scav(commands.Cog):
         return TeamPuzzleActivity.objects.filter(verification_photo=photo).first()
 
     async def scav_deny(self, i: Interaction, photo: VerificationPhoto, channel: TextChannel):
-        puzzle = await sync_to_async(self.get_puzzle_from_photo)(photo)
+        puzzle = await self.bot.db(self.get_puzzle_from_photo, photo)
         puzzle.verification_photo = None
         puzzle.puzzle_completed_at = None
-        await sync_to_async(puzzle.save)()
-        await sync_to_async(photo.delete)()
+        await self.bot.db(puzzle.save)
+        await self.bot.db(photo.delete)
+        await self.team_progressed(await self.bot.db(self.get_activity_team, puzzle))
         await i.send("Rejected puzzle photo!")
         await channel.send("Your scav answer has been rejected!")
 
+    def get_photo_team_id(self, photo: VerificationPhoto) -> Optional[int]:
+        return TeamPuzzleActivity.objects.filter(verification_photo=photo).values_list("team_id", flat=True).first()
+
     async def scav_approve(self, i: Interaction, photo: VerificationPhoto, channel: TextChannel):
-        await sync_to_async(photo.approve)()
+        await self.bot.db(photo.approve)
+        team_id = await self.bot.db(self.get_photo_team_id, photo)
+        if team_id is not None:
+            await self.refresh_team_state(team_id)
         await i.send("Approved puzzle photo!")
         await channel.send("Your scav answer has been approved!")
 
@@ -287,34 +542,54 @@ class Scav(commands.Cog):
         if i.channel.id not in self.config["team_channels"]:
             await i.send("This is not a scav channel!", ephemeral=True)
             return
-        user = await sync_to_async(self.get_user_from_discord)(i.user)
-        team = await sync_to_async(self.get_user_team)(user)
+        ctx = await self.caller_context(i.user)
+        team = ctx.team
         if team is None:
             await i.send("You are not on a team!", ephemeral=True)
             return
-        if team.scavenger_finished:
+        if ctx.finished:
             await i.send("Your team has already completed scav!", ephemeral=True)
             return
 
-        puzzles = await sync_to_async(self.get_team_active_puzzles)(team)
-        if len(puzzles) != 1:
+        if len(ctx.puzzles) != 1:
             await i.send("Your team has no active puzzles or too many active puzzles!", ephemeral=True)
             return
-        puzzle = puzzles[0]
+        puzzle = ctx.puzzles[0]
         if not puzzle.enabled:
-            team.refresh_scavenger_progress()
+            await self.bot.db(team.refresh_scavenger_progress)
+            await self.refresh_team_state(team.id)
             await i.send("An error occurred, please resubmit." +
                          " If this continues please contact planning", ephemeral=True)
             return
         if puzzle.puzzle_file:
-            f = open(puzzle.puzzle_file.path, "rb")
             f_name = puzzle.puzzle_file_display_filename
             if f_name is None:
-                f_name = puzzle.puzzle_file.name
-            await i.send(puzzle.puzzle_text, files=File(f, filename=f_name))
+                f_name = os.path.basename(puzzle.puzzle_file.name)
+            path = puzzle.puzzle_file.path
+            key = await self.puzzle_files.key(puzzle.id, path)
+            url = None
+            staging_channel = self.bot.get_channel(self.staging_channel) if self.staging_channel else None
+            if staging_channel is not None:
+                try:
+                    url = await self.staged_files.url(
+                        key, lambda: self.stage_puzzle_file(staging_channel, key, path, f_name))
+                except nextcord.HTTPException as e:
+                    logger.warning(f"Failed to stage puzzle file for puzzle {puzzle.id}: {e}")
+            if url is not None:
+                await i.send(f"{puzzle.puzzle_text}\n{url}")
+            else:
+                data = await self.puzzle_files.get(key, path)
+                await i.send(puzzle.puzzle_text, file=nextcord.File(MemoryViewReader(data), filename=f_name))
         else:
             await i.send(puzzle.puzzle_text)
 
+    async def stage_puzzle_file(self, channel: TextChannel, key, path: str, filename: str) -> str:
+        """Upload the puzzle file to the staging channel, returning the attachment URL."""
+
+        data = await self.puzzle_files.get(key, path)
+        message = await channel.send(f"Puzzle {key[0]}", file=nextcord.File(MemoryViewReader(data), filename=filename))
+        return message.attachments[0].url
+
     def get_team_by_name(self, team_name):
         return Team.objects.filter(display_name__iexact=team_name).first()
 
@@ -326,11 +601,12 @@ class Scav(commands.Cog):
     async def scav_lock(self, i: Interaction, team_name: Role, minutes: int = 15):
         """Lock a team's scav"""
 
-        team = await sync_to_async(self.get_team_by_role)(team_name.id)
+        team = await self.bot.db(self.get_team_by_role, team_name.id)
         if team is None:
             await i.send("Invalid team", ephemeral=True)
             return
-        await sync_to_async(team.scavenger_lock)(minutes)
+        await self.bot.db(team.scavenger_lock, minutes)
+        await self.refresh_team_state(team.id)
 
         await i.send(f"Scav locked for {minutes} minutes.", ephemeral=True)
 
@@ -342,25 +618,34 @@ class Scav(commands.Cog):
     async def scav_unlock(self, i: Interaction, team_name: Role):
         """Unlock a team's scav"""
 
-        team = await sync_to_async(self.get_team_by_role)(team_name.id)
+        team = await self.bot.db(self.get_team_by_role, team_name.id)
         if team is None:
             await i.send("Invalid team", ephemeral=True)
             return
 
-        await sync_to_async(self.team_scav_unlock)(team)
+        await self.bot.db(self.team_scav_unlock, team)
+        await self.refresh_team_state(team.id)
 
         await i.send("Scav unlocked.", ephemeral=True)
 
+    @slash_command(name="refresh_frosh_roles", description="Reloads the cached frosh role names")
+    @has_permission("common_models.manage_scav")
+    async def refresh_frosh_roles(self, i: Interaction):
+        """Reload the frosh role names used to tell roles apart from teams."""
+
+        names = await self.bot.db(load_frosh_role_names)
+        await i.send(f"Reloaded {len(names)} frosh roles: {', '.join(sorted(names))}", ephemeral=True)
+
     @slash_command(name="hint", description="Requests a hint for the question")
     async def hint(self, i: Interaction):
         """Request hint for the question."""
 
-        user = await sync_to_async(self.get_user_from_discord)(i.user)
-        team = await sync_to_async(self.get_user_team)(user)
+        ctx = await self.caller_context(i.user)
+        team = ctx.team
         if team is None:
             await i.send("You are not on a team!", ephemeral=True)
             return
-        if team.scavenger_finished:
+        if ctx.finished:
             await i.send("Your team has already completed scav!", ephemeral=True)
             return
         await i.send("This is not implemented!", ephemeral=True)
@@ -0,0 +1,64 @@
+"""Async HTTP client for sending scav verification photos to the website."""
+
+import asyncio
+import logging
+import os
+from typing import Optional
+
+import aiohttp
+
+logger = logging.getLogger("Cogs.Scav.Transfer")
+
+
+class PhotoUploadError(Exception):
+    """Exception raised when a photo could not be uploaded to the website."""
+
+
+class ScavTransferClient:
+    """Shared, pooled aiohttp session used to upload verification photos with retries."""
+
+    def __init__(self, server: str, *, timeout: float = 30, retries: int = 3, backoff: float = 0.5,
+                 pool_size: int = 20):
+        self.server = server
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        # Created lazily since a session has to be made inside the running event loop
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    def _auth(self) -> aiohttp.BasicAuth:
+        return aiohttp.BasicAuth(os.environ['SERVER_USER'], os.environ['SERVER_PASS'])
+
+    async def upload_photo(self, data: bytes, filename: str, content_type: Optional[str] = None) -> int:
+        """Upload the photo bytes to the site's api/photo endpoint and return the new photo id."""
+
+        url = self.server + "api/photo"
+        for attempt in range(self.retries + 1):
+            # Form data can only be consumed once, so it is rebuilt for every attempt
+            form = aiohttp.FormData()
+            form.add_field("photo", data, filename=filename, content_type=content_type)
+            try:
+                async with self.session.post(url, data=form, auth=self._auth()) as r:
+                    if r.status == 200:
+                        body = await r.json(content_type=None)
+                        return body['id']
+                    if r.status < 500:
+                        raise PhotoUploadError(f"Photo upload rejected with status {r.status}")
+                    logger.warning(f"Photo upload failed with status {r.status}, attempt {attempt + 1}")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning(f"Photo upload failed: {e!r}, attempt {attempt + 1}")
+            if attempt < self.retries:
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+        raise PhotoUploadError(f"Photo upload failed after {self.retries + 1} attempts")
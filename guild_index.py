@@ -0,0 +1,156 @@
+"""Lookups of a guild's channels, categories and roles by id and name without scanning the guild."""
+
+from __future__ import annotations
+
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+import nextcord
+
+logger = logging.getLogger("GuildIndex")
+
+
+def _add(names: Dict[Any, List[Any]], key: Any, obj: Any) -> None:
+    names.setdefault(key, []).append(obj)
+
+
+def _remove(names: Dict[Any, List[Any]], key: Any, obj: Any) -> None:
+    found = names.get(key)
+    if found is None:
+        return
+    found[:] = [o for o in found if o.id != obj.id]
+    if not found:
+        del names[key]
+
+
+def _channel_key(channel: Any) -> Tuple[Optional[int], str]:
+    return (getattr(channel, "category_id", None), channel.name.lower())
+
+
+class _Index:
+    def __init__(self, guild: nextcord.Guild):
+        self.guild = guild
+        self.channels: Dict[int, Any] = {}
+        self.roles: Dict[int, nextcord.Role] = {}
+        self.category_names: Dict[str, List[nextcord.CategoryChannel]] = {}
+        self.role_names: Dict[str, List[nextcord.Role]] = {}
+        # (category id, lower cased name) -> text or voice channels
+        self.text_channel_names: Dict[Tuple[Optional[int], str], List[nextcord.TextChannel]] = {}
+        self.voice_channel_names: Dict[Tuple[Optional[int], str], List[nextcord.VoiceChannel]] = {}
+        for channel in guild.channels:
+            self.add_channel(channel)
+        for role in guild.roles:
+            self.add_role(role)
+
+    def add_channel(self, channel: Any) -> None:
+        self.channels[channel.id] = channel
+        if isinstance(channel, nextcord.CategoryChannel):
+            _add(self.category_names, channel.name.lower(), channel)
+        elif isinstance(channel, nextcord.TextChannel):
+            _add(self.text_channel_names, _channel_key(channel), channel)
+        elif isinstance(channel, nextcord.VoiceChannel):
+            _add(self.voice_channel_names, _channel_key(channel), channel)
+
+    def remove_channel(self, channel: Any) -> None:
+        self.channels.pop(channel.id, None)
+        if isinstance(channel, nextcord.CategoryChannel):
+            _remove(self.category_names, channel.name.lower(), channel)
+        elif isinstance(channel, nextcord.TextChannel):
+            _remove(self.text_channel_names, _channel_key(channel), channel)
+        elif isinstance(channel, nextcord.VoiceChannel):
+            _remove(self.voice_channel_names, _channel_key(channel), channel)
+
+    def add_role(self, role: nextcord.Role) -> None:
+        self.roles[role.id] = role
+        _add(self.role_names, role.name.lower(), role)
+
+    def remove_role(self, role: nextcord.Role) -> None:
+        self.roles.pop(role.id, None)
+        _remove(self.role_names, role.name.lower(), role)
+
+
+class GuildIndex:
+    """Maps ids and lower cased names to the channels, categories and roles of each guild.
+
+    A guild is indexed on first use and then kept up to date from the channel and role gateway events.
+    After a reconnect nextcord creates new guild objects, which are indexed again.
+    """
+
+    def __init__(self):
+        self._guilds: Dict[int, _Index] = {}
+        self.builds = 0
+
+    def _get(self, guild: nextcord.Guild) -> _Index:
+        index = self._guilds.get(guild.id)
+        if index is None or index.guild is not guild:
+            index = self._guilds[guild.id] = _Index(guild)
+            self.builds += 1
+            logger.debug(f"Indexed {len(index.channels)} channels and {len(index.roles)} roles of {guild.name}")
+        return index
+
+    def _indexed(self, guild: nextcord.Guild) -> Optional[_Index]:
+        index = self._guilds.get(guild.id)
+        if index is None or index.guild is not guild:
+            return None
+        return index
+
+    def channel(self, guild: nextcord.Guild, id: int) -> Optional[Any]:
+        return self._get(guild).channels.get(id)
+
+    def channels(self, guild: nextcord.Guild) -> List[Any]:
+        return list(self._get(guild).channels.values())
+
+    def category(self, guild: nextcord.Guild, name: str) -> Optional[nextcord.CategoryChannel]:
+        found = self._get(guild).category_names.get(name.lower())
+        return found[0] if found else None
+
+    def text_channel(self, guild: nextcord.Guild, category: Optional[nextcord.CategoryChannel],
+                     name: str) -> Optional[nextcord.TextChannel]:
+        key = (category.id if category is not None else None, name.lower())
+        found = self._get(guild).text_channel_names.get(key)
+        return found[0] if found else None
+
+    def voice_channel(self, guild: nextcord.Guild, category: Optional[nextcord.CategoryChannel],
+                      name: str) -> Optional[nextcord.VoiceChannel]:
+        key = (category.id if category is not None else None, name.lower())
+        found = self._get(guild).voice_channel_names.get(key)
+        return found[0] if found else None
+
+    def role(self, guild: nextcord.Guild, name: str) -> Optional[nextcord.Role]:
+        found = self._get(guild).role_names.get(name.lower())
+        return found[0] if found else None
+
+    def role_by_id(self, guild: nextcord.Guild, id: int) -> Optional[nextcord.Role]:
+        return self._get(guild).roles.get(id)
+
+    def channel_created(self, channel: Any) -> None:
+        index = self._indexed(channel.guild)
+        if index is not None:
+            index.add_channel(channel)
+
+    def channel_deleted(self, channel: Any) -> None:
+        index = self._indexed(channel.guild)
+        if index is not None:
+            index.remove_channel(channel)
+
+    def channel_updated(self, before: Any, after: Any) -> None:
+        index = self._indexed(after.guild)
+        if index is not None:
+            index.remove_channel(before)
+            index.add_channel(after)
+
+    def role_created(self, role: nextcord.Role) -> None:
+        index = self._indexed(role.guild)
+        if index is not None:
+            index.add_role(role)
+
+    def role_deleted(self, role: nextcord.Role) -> None:
+        index = self._indexed(role.guild)
+        if index is not None:
+            index.remove_role(role)
+
+    def role_updated(self, before: nextcord.Role, after: nextcord.Role) -> None:
+        index = self._indexed(after.guild)
+        if index is not None:
+            index.remove_role(before)
+            index.add_role(after)
@@ -0,0 +1,73 @@
+"""In memory team leaderboard shared by the scoreboards."""
+
+from bisect import bisect_left, insort
+from typing import Dict, Iterable, List, Tuple
+
+
+def rank(scores: Iterable[Tuple[str, int]]) -> List[Tuple[int, str, int]]:
+    """Assign places to (name, score) pairs already sorted from highest to lowest score.
+
+    Tied scores share a place and the next place skips ahead, eg. 1, 2, 2, 4.
+    """
+
+    standings = []
+    cur_place = 0
+    cur_score = None
+    next_place = 1
+    for name, score in scores:
+        if score == cur_score:
+            place = cur_place
+        else:
+            place = next_place
+            cur_place = next_place
+            cur_score = score
+        next_place += 1
+        standings.append((place, name, score))
+    return standings
+
+
+class Leaderboard:
+    """Teams kept sorted by score so updates don't need the whole table reloaded and resorted.
+
+    Positions are found with a binary search, ties are ordered by team id like the database order.
+    The keys are a plain list, so an update is an O(log n) search plus an O(n) shift on insert and delete.
+    With a couple hundred teams that shift is a small memmove, and rendering the standings is O(n) anyway,
+    so a sorted container dependency wouldn't pay for itself.
+    """
+
+    def __init__(self) -> None:
+        self.seeded = False
+        self._keys: List[Tuple[int, int]] = []
+        self._teams: Dict[int, Tuple[str, int]] = {}
+
+    def seed(self, teams: Iterable[Tuple[int, str, int]]) -> None:
+        """Replace the board with (team id, name, score) entries."""
+        self._teams = {team_id: (name, score) for team_id, name, score in teams}
+        self._keys = sorted((-score, team_id) for team_id, (name, score) in self._teams.items())
+        self.seeded = True
+
+    def _remove_key(self, team_id: int) -> None:
+        old = self._teams.get(team_id)
+        if old is None:
+            return
+        key = (-old[1], team_id)
+        idx = bisect_left(self._keys, key)
+        if idx < len(self._keys) and self._keys[idx] == key:
+            del self._keys[idx]
+
+    def update(self, team_id: int, name: str, score: int) -> None:
+        """Move the team to its new score, O(log n) to find the position and O(n) to shift the list."""
+        self._remove_key(team_id)
+        self._teams[team_id] = (name, score)
+        insort(self._keys, (-score, team_id))
+
+    def remove(self, team_id: int) -> None:
+        self._remove_key(team_id)
+        self._teams.pop(team_id, None)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def standings(self) -> List[Tuple[int, str, int]]:
+        """Returns (place, name, score) for every team from first to last."""
+        return rank(self._teams[team_id] for _, team_id in self._keys)
@@ -0,0 +1,174 @@
+"""Latency and event metrics for the bot, served in the Prometheus text format."""
+
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import functools
+import logging
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger("Metrics")
+
+Labels = Tuple[Tuple[str, str], ...]
+
+# Number of DB queries made while handling the current interaction
+interaction_queries: contextvars.ContextVar[Optional[List[int]]] = contextvars.ContextVar(
+    "interaction_queries", default=None)
+
+
+def percentile(samples: List[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Summary:
+    """Count and sum of every observation plus a window of recent ones for quantiles."""
+
+    QUANTILES = (0.5, 0.95, 0.99)
+
+    def __init__(self, window: int = 1024):
+        self.count = 0
+        self.total = 0.0
+        self.samples: Deque[float] = deque(maxlen=window)
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.samples.append(value)
+
+    def quantiles(self) -> Dict[float, float]:
+        samples = list(self.samples)
+        return {q: percentile(samples, q) for q in self.QUANTILES}
+
+
+def _labels(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (k + '="' + v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+               for k, v in pairs)
+    return "{" + ",".join(escaped) + "}"
+
+
+class Metrics:
+    """Registry of counters and latency summaries keyed by metric name and labels."""
+
+    def __init__(self, prefix: str = "engfrosh_bot"):
+        self.prefix = prefix
+        self.started_at = time.monotonic()
+        self.counters: Dict[str, Dict[Labels, float]] = {}
+        self.summaries: Dict[str, Dict[Labels, Summary]] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    def inc(self, name: str, amount: float = 1, **labels: str) -> None:
+        series = self.counters.setdefault(name, {})
+        key = _labels(labels)
+        series[key] = series.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        series = self.summaries.setdefault(name, {})
+        key = _labels(labels)
+        if key not in series:
+            series[key] = Summary()
+        series[key].observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def render_prometheus(self) -> str:
+        lines = []
+        for name, series in sorted(self.counters.items()):
+            full = f"{self.prefix}_{name}"
+            lines.append(f"# TYPE {full} counter")
+            for labels, value in series.items():
+                lines.append(f"{full}{_format_labels(labels)} {value}")
+        for name, series in sorted(self.summaries.items()):
+            full = f"{self.prefix}_{name}"
+            lines.append(f"# TYPE {full} summary")
+            for labels, summary in series.items():
+                for q, value in summary.quantiles().items():
+                    lines.append(f"{full}{_format_labels(labels, ('quantile', str(q)))} {value}")
+                lines.append(f"{full}_sum{_format_labels(labels)} {summary.total}")
+                lines.append(f"{full}_count{_format_labels(labels)} {summary.count}")
+        return "\n".join(lines) + "\n"
+
+    def render_text(self) -> str:
+        """Short human readable version for the /stats command."""
+
+        uptime = time.monotonic() - self.started_at
+        lines = [f"Uptime: {uptime / 60:.1f} minutes"]
+        for name, series in sorted(self.summaries.items()):
+            lines.append(f"{name}:")
+            ordered = sorted(series.items(), key=lambda item: item[1].count, reverse=True)
+            for labels, summary in ordered:
+                q = summary.quantiles()
+                label = ",".join(v for _, v in labels) or "all"
+                lines.append(f"  {label}: n={summary.count} p50={q[0.5]:.3f} p95={q[0.95]:.3f} p99={q[0.99]:.3f}")
+        for name, series in sorted(self.counters.items()):
+            lines.append(f"{name} (per minute):")
+            ordered = sorted(series.items(), key=lambda item: item[1], reverse=True)
+            for labels, value in ordered:
+                label = ",".join(v for _, v in labels) or "all"
+                lines.append(f"  {label}: {value} ({value * 60 / uptime:.1f}/min)")
+        return "\n".join(lines)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request = await asyncio.wait_for(reader.readline(), 5)
+            # Drain the headers, the request path doesn't matter
+            while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+                pass
+            if request.startswith(b"GET"):
+                body = self.render_prometheus().encode()
+                status = b"200 OK"
+            else:
+                body = b""
+                status = b"405 Method Not Allowed"
+            writer.write(b"HTTP/1.1 " + status + b"\r\nContent-Type: text/plain; version=0.0.4\r\n" +
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 9108) -> None:
+        """Serve the metrics over HTTP for Prometheus to scrape."""
+        if self._server is None:
+            self._server = await asyncio.start_server(self._handle, host, port)
+            logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+
+
+def count_queries(execute, sql, params, many, context):
+    """Django execute wrapper counting queries towards the current interaction."""
+    counter = interaction_queries.get()
+    if counter is not None:
+        counter[0] += 1
+    return execute(sql, params, many, context)
+
+
+def instrument_http(http, metrics: Metrics) -> None:
+    """Time every discord REST request made through nextcord's HTTP client."""
+
+    request = http.request
+
+    @functools.wraps(request)
+    async def timed_request(route, **kwargs):
+        with metrics.timer("discord_request_seconds", method=route.method, path=route.path):
+            return await request(route, **kwargs)
+    http.request = timed_request
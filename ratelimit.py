@@ -0,0 +1,81 @@
+"""Token bucket rate limiting, shared by the cogs."""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+
+class TokenBucket:
+    """Allows rate calls per second on average with bursts of up to capacity."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock: Optional[asyncio.Lock] = None
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def ready(self) -> bool:
+        """Whether a token is available, without taking it."""
+        self._refill()
+        return self.tokens >= 1
+
+    def try_acquire(self) -> bool:
+        """Take a token if one is available without waiting."""
+        if self.ready():
+            self.tokens -= 1
+            return True
+        return False
+
+    def retry_after(self) -> float:
+        """Seconds until the next token is available."""
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    async def acquire(self) -> None:
+        """Wait for a token, callers are served in order."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while not self.try_acquire():
+                await asyncio.sleep(self.retry_after())
+
+
+def try_acquire_all(*buckets: TokenBucket) -> bool:
+    """Take a token from every bucket, or from none of them if any is empty."""
+    if not all(bucket.ready() for bucket in buckets):
+        return False
+    for bucket in buckets:
+        bucket.try_acquire()
+    return True
+
+
+class KeyedRateLimiter:
+    """One token bucket per key, keeping the most recently used max_keys buckets."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None, max_keys: int = 10000):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_keys = max_keys
+        self._buckets: OrderedDict[Hashable, TokenBucket] = OrderedDict()
+
+    def bucket(self, key: Hashable) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.capacity)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def retry_after(self, key: Hashable) -> float:
+        return self.bucket(key).retry_after()
@@ -0,0 +1,58 @@
+from leaderboard import Leaderboard, rank
+
+
+def make_board():
+    board = Leaderboard()
+    board.seed([(1, "Alpha", 3), (2, "Bravo", 5), (3, "Charlie", 1), (4, "Delta", 3)])
+    return board
+
+
+def test_rank_competition_ties():
+    scores = [("A", 9), ("B", 7), ("C", 7), ("D", 4), ("E", 4), ("F", 1)]
+    assert [place for place, _, _ in rank(scores)] == [1, 2, 2, 4, 4, 6]
+
+
+def test_rank_empty_and_all_tied():
+    assert rank([]) == []
+    assert rank([("A", 0), ("B", 0)]) == [(1, "A", 0), (1, "B", 0)]
+
+
+def test_seed_orders_by_score_then_team_id():
+    assert make_board().standings() == [(1, "Bravo", 5), (2, "Alpha", 3), (2, "Delta", 3), (4, "Charlie", 1)]
+
+
+def test_update_moves_team_up():
+    board = make_board()
+    board.update(3, "Charlie", 6)
+    assert board.standings()[0] == (1, "Charlie", 6)
+    assert len(board) == 4
+
+
+def test_update_moves_team_down():
+    board = make_board()
+    board.update(2, "Bravo", 0)
+    assert board.standings()[-1] == (4, "Bravo", 0)
+    assert [name for _, name, _ in board.standings()] == ["Alpha", "Delta", "Charlie", "Bravo"]
+
+
+def test_update_adds_new_team_and_renames():
+    board = make_board()
+    board.update(5, "Echo", 3)
+    board.update(1, "Alpha Prime", 3)
+    assert board.standings() == [(1, "Bravo", 5), (2, "Alpha Prime", 3), (2, "Delta", 3), (2, "Echo", 3),
+                                 (5, "Charlie", 1)]
+
+
+def test_remove():
+    board = make_board()
+    board.remove(2)
+    board.remove(42)
+    assert len(board) == 3
+    assert board.standings() == [(1, "Alpha", 3), (1, "Delta", 3), (3, "Charlie", 1)]
+
+
+def test_rendered_output_order():
+    board = make_board()
+    board.update(1, "Alpha", 4)
+    rendered = "".join(f"{place}. {name}: {score}\n" for place, name, score in board.standings())
+    assert rendered == "1. Bravo: 5\n2. Alpha: 4\n3. Delta: 3\n4. Charlie: 1\n"
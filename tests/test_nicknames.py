@@ -0,0 +1,62 @@
+"""Checks the batched nicknames of cogManagement.utils against DiscordUser.compute_name.
+
+Needs django and the common_models submodule, runs against the SQLite database of the benchmarks.
+"""
+
+import importlib.util
+import os
+import tempfile
+
+import pytest
+
+if importlib.util.find_spec("django") is None or importlib.util.find_spec("common_models") is None:
+    pytest.skip("needs django and the common_models submodule", allow_module_level=True)
+
+os.environ.setdefault("BENCH_DB", os.path.join(tempfile.gettempdir(), "engfrosh_test_nicknames.sqlite3"))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.contrib.auth.models import User  # noqa: E402
+from django.conf import settings  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+
+import common_models.models as md  # noqa: E402
+import cogs.cogManagement.utils as utils  # noqa: E402
+
+USERS = [
+    # (name, override nick, pronouns in the order they are added)
+    ("Alex Smith", None, []),
+    ("Sam Lee", None, ["She/Her"]),
+    ("jordan mcdonald", None, ["They/Them", "He/Him"]),
+    ("A Very Long Name That Is Longer Than Discord Allows", None, ["He/Him", "They/Them"]),
+    ("Taylor Kim", "Tay", ["She/Her"]),
+]
+
+
+@pytest.fixture(scope="module")
+def discord_ids():
+    if os.path.exists(settings.DATABASES["default"]["NAME"]):
+        os.remove(settings.DATABASES["default"]["NAME"])
+    call_command("migrate", run_syncdb=True, verbosity=0)
+    ids = []
+    for n, (name, nick, pronouns) in enumerate(USERS):
+        user = User.objects.create(username=f"user{n}")
+        md.UserDetails.objects.create(user=user, name=name, override_nick=nick)
+        # Added out of order so the batch has to sort by order like the model does
+        for order, pronoun in reversed(list(enumerate(pronouns))):
+            md.Pronoun.objects.create(name=pronoun, order=order, user=user)
+        md.DiscordUser.objects.create(id=1000 + n, user=user, discord_username=f"user{n}", discriminator=0)
+        ids.append(1000 + n)
+    return ids
+
+
+def test_batch_matches_compute_name(discord_ids):
+    expected = {id: md.DiscordUser.objects.get(id=id).compute_name() for id in discord_ids}
+    assert utils.compute_discord_names(discord_ids) == expected
+
+
+def test_batch_leaves_out_unknown_ids(discord_ids):
+    assert set(utils.compute_discord_names(discord_ids + [1])) == set(discord_ids)